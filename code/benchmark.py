@@ -0,0 +1,419 @@
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from blockchain import Block, Blockchain
+from event import QUEUE_BACKENDS, make_queue
+from peer import Node
+from transaction import Transaction
+
+
+def noop():
+    pass
+
+
+def bench_queue(backend, pending, operations, seed=0):
+    """
+    Time the classic hold model on an event queue.
+
+    The queue is filled with `pending` events, then each operation pops the
+    earliest event and schedules a new one a random exponential gap after
+    it, so the number of pending events stays constant.
+
+    Parameters:
+    - backend: Name of the queue backend.
+    - pending: Number of events kept in the queue.
+    - operations: Number of pop + schedule operations to time.
+    - seed: Seed for the event time gaps.
+
+    Returns the mean time per operation in nanoseconds.
+    """
+    rng = random.Random(seed)
+    queue = make_queue(backend)
+    for _ in range(pending):
+        queue.schedule(rng.expovariate(1.0), noop)
+    gaps = [rng.expovariate(1.0) for _ in range(operations)]
+
+    pop_entry = queue.pop_entry
+    schedule = queue.schedule
+    start = time.perf_counter()
+    for gap in gaps:
+        now = pop_entry()[0]
+        schedule(now + gap, noop)
+    elapsed = time.perf_counter() - start
+    return elapsed / operations * 1e9
+
+
+# Modules that must not be loaded by a pure simulation import
+PLOTTING_MODULES = ["matplotlib", "networkx"]
+
+
+def bench_startup(module="simulator", repeats=10):
+    """
+    Time a fresh interpreter importing a module.
+
+    Parameters:
+    - module: Module imported by the interpreter.
+    - repeats: Number of interpreters started.
+
+    Returns the median wall time in seconds and the plotting modules that
+    the import loaded.
+    """
+    code = (
+        f"import sys, {module}; "
+        f"print(' '.join(m for m in {PLOTTING_MODULES!r} if m in sys.modules))"
+    )
+    here = os.path.dirname(os.path.abspath(__file__))
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=here,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), result.stdout.split()
+
+
+def median_time(function, repeats):
+    """Return the median wall time of calling a function `repeats` times."""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def build_chain(blockchain, length, transactions_per_block=10, seed=0):
+    """Extend a blockchain with `length` blocks of random transactions, returning the RNG used."""
+    rng = random.Random(seed)
+    for _ in range(length):
+        transactions = [
+            Transaction(rng.randrange(100), rng.randrange(100), rng.randint(1, 50))
+            for _ in range(transactions_per_block)
+        ]
+        transactions.append(Transaction(-1, 0, 50))
+        blockchain.create_block(transactions, 0)
+    return rng
+
+
+def bench_longest_chain(length, repeats=5):
+    """Return the time of Blockchain.get_longest_chain on a chain of `length` blocks, in ns."""
+    blockchain = Blockchain()
+    build_chain(blockchain, length)
+    return median_time(blockchain.get_longest_chain, repeats) * 1e9
+
+
+def bench_block_validation(length, operations=1000, repeats=5):
+    """
+    Time Node.validate_block and Node.get_balance on a chain of `length` blocks.
+
+    Every validated block is new, so the memoized result of an earlier
+    validation is never reused.
+
+    Returns the mean time of each operation in ns.
+    """
+    node = Node(0, 1, 1, 1)
+    rng = build_chain(node.blockchain, length)
+    tip = node.blockchain.get_tip()
+    blocks = [
+        Block(
+            f"candidate-{i}",
+            tip.block_id,
+            [Transaction(rng.randrange(100), rng.randrange(100), 1) for _ in range(10)],
+        )
+        for i in range(operations * repeats)
+    ]
+    candidates = iter(blocks)
+    accounts = [rng.randrange(100) for _ in range(operations)]
+
+    def validate():
+        for _ in range(operations):
+            node.validate_block(next(candidates))
+
+    def balances():
+        for account in accounts:
+            node.get_balance(account)
+
+    return (
+        median_time(validate, repeats) / operations * 1e9,
+        median_time(balances, repeats) / operations * 1e9,
+    )
+
+
+def bench_topology(n, repeats=3):
+    """Return the time of generating the simulator's random topology with n nodes, in s."""
+    from topology import generate_topology
+
+    rng = np.random.default_rng(0)
+    return median_time(lambda: generate_topology("random", n, rng), repeats)
+
+
+def bench_legacy_graph(n, repeats=3):
+    """Return the time of graph.generate_connected_graph with n nodes, in s."""
+    from graph import generate_connected_graph
+
+    rng = np.random.default_rng(0)
+    return median_time(lambda: generate_connected_graph(n, rng), repeats)
+
+
+def bench_latency_setup(n, repeats=3):
+    """Return the time of generating the link latencies of a simulator with n nodes, in s."""
+    from simulator import Simulator
+
+    simulator = Simulator(n, 0.5, 0.5, seed=0)
+    speeds = [node.speed for node in simulator.nodes]
+    return median_time(lambda: simulator.generate_latencies(speeds), repeats)
+
+
+def bench_simulate(n, events, repeats=1):
+    """Return the throughput of Simulator.simulate with n nodes over `events` events, in events/s."""
+    from simulator import Simulator
+
+    rates = []
+    for _ in range(repeats):
+        simulator = Simulator(n, 0.5, 0.5, max_events=events, seed=0)
+        start = time.perf_counter()
+        processed = simulator.simulate()
+        rates.append(processed / (time.perf_counter() - start))
+    return statistics.median(rates)
+
+
+# Units of the suite's results; throughputs regress when they go down
+UNITS = {"ns/op": False, "s": False, "events/s": True}
+
+
+def run_suite(nodes, events, lengths, queue_sizes, repeats, legacy_graph_max, log=print):
+    """
+    Time the simulator's hot paths at several scales.
+
+    Parameters:
+    - nodes: Network sizes for the topology, latency and simulation benchmarks.
+    - events: Numbers of events for the simulation benchmark.
+    - lengths: Chain lengths for the blockchain benchmarks.
+    - queue_sizes: Numbers of pending events for the queue benchmark.
+    - repeats: Number of timed repeats, of which the median is kept.
+    - legacy_graph_max: Largest n for graph.generate_connected_graph, whose
+      adjacency matrix is quadratic in n.
+    - log: Function called with a line describing each result.
+
+    Returns a dict mapping each benchmark name to its value and unit.
+    """
+    results = {}
+
+    def record(name, value, unit):
+        results[name] = {"value": value, "unit": unit}
+        log(f"{name:<45} {value:>14.6g} {unit}")
+
+    for length in lengths:
+        record(
+            f"get_longest_chain/length={length}",
+            bench_longest_chain(length, repeats),
+            "ns/op",
+        )
+        validate, balance = bench_block_validation(length, repeats=repeats)
+        record(f"validate_block/length={length}", validate, "ns/op")
+        record(f"get_balance/length={length}", balance, "ns/op")
+    for pending in queue_sizes:
+        for backend in sorted(QUEUE_BACKENDS):
+            record(
+                f"queue/{backend}/pending={pending}",
+                bench_queue(backend, pending, min(10 * pending, 10**6)),
+                "ns/op",
+            )
+    for n in nodes:
+        record(f"topology/n={n}", bench_topology(n, repeats), "s")
+        if n <= legacy_graph_max:
+            record(f"generate_connected_graph/n={n}", bench_legacy_graph(n, repeats), "s")
+        record(f"latency_setup/n={n}", bench_latency_setup(n, repeats), "s")
+    for n in nodes:
+        for count in events:
+            record(f"simulate/n={n}/events={count}", bench_simulate(n, count), "events/s")
+    return results
+
+
+def compare_results(baseline, current, threshold):
+    """
+    Compare two benchmark result files.
+
+    Parameters:
+    - baseline: Results of the reference run.
+    - current: Results of the run being checked.
+    - threshold: Relative slowdown above which a result is a regression.
+
+    Returns a list of (name, baseline value, current value, slowdown,
+    regressed) tuples for the benchmarks present in both.
+    """
+    rows = []
+    for name, result in current["results"].items():
+        reference = baseline["results"].get(name)
+        if reference is None or reference["unit"] != result["unit"]:
+            continue
+        if UNITS[result["unit"]]:
+            slowdown = reference["value"] / result["value"] - 1
+        else:
+            slowdown = result["value"] / reference["value"] - 1
+        rows.append(
+            (name, reference["value"], result["value"], slowdown, slowdown > threshold)
+        )
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the simulator")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    queue_parser = subparsers.add_parser(
+        "queue", help="Compare event queue backends under the hold model"
+    )
+    queue_parser.add_argument(
+        "--backends", nargs="+", default=sorted(QUEUE_BACKENDS), choices=QUEUE_BACKENDS
+    )
+    queue_parser.add_argument(
+        "--pending", nargs="+", type=int, default=[10**5, 10**6, 10**7]
+    )
+    queue_parser.add_argument("--operations", type=int, default=10**6)
+
+    startup_parser = subparsers.add_parser(
+        "startup", help="Time importing the simulator in a fresh interpreter"
+    )
+    startup_parser.add_argument("--module", default="simulator")
+    startup_parser.add_argument("--repeats", type=int, default=10)
+    startup_parser.add_argument(
+        "--max-seconds",
+        type=float,
+        default=None,
+        help="Fail if the median import time is above this",
+    )
+
+    suite_parser = subparsers.add_parser(
+        "suite", help="Time the hot paths at several scales and save the results as JSON"
+    )
+    suite_parser.add_argument(
+        "--nodes", nargs="+", type=int, default=[10, 100, 1000, 10000]
+    )
+    suite_parser.add_argument(
+        "--events", nargs="+", type=int, default=[10**3, 10**4, 10**5, 10**6]
+    )
+    suite_parser.add_argument(
+        "--lengths", nargs="+", type=int, default=[10, 100, 1000, 10000]
+    )
+    suite_parser.add_argument(
+        "--queue-sizes", nargs="+", type=int, default=[10**3, 10**5]
+    )
+    suite_parser.add_argument("--repeats", type=int, default=5)
+    suite_parser.add_argument("--legacy-graph-max", type=int, default=1000)
+    suite_parser.add_argument("--output", default="benchmarks.json")
+
+    compare_parser = subparsers.add_parser(
+        "compare", help="Flag regressions between two suite result files"
+    )
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Relative slowdown reported as a regression",
+    )
+
+    profile_parser = subparsers.add_parser(
+        "profile", help="Profile the time spent on each kind of event in a simulation"
+    )
+    profile_parser.add_argument("--peers", type=int, default=100)
+    profile_parser.add_argument("--events", type=int, default=10**5)
+    profile_parser.add_argument("--seed", type=int, default=0)
+    profile_parser.add_argument(
+        "--folded", default=None, help="Also sample stacks into this flamegraph file"
+    )
+    profile_parser.add_argument(
+        "--output", default=None, help="JSON file for the event statistics"
+    )
+
+    args = parser.parse_args()
+    if args.benchmark == "profile":
+        from profiling import StackSampler
+        from simulator import Simulator
+
+        simulator = Simulator(
+            args.peers, 0.5, 0.5, max_events=args.events, seed=args.seed, profile=True
+        )
+        if args.folded is None:
+            simulator.simulate()
+        else:
+            with StackSampler(args.folded):
+                simulator.simulate()
+        profiler = simulator.profiler
+        print(profiler.format())
+        if profiler.queue_sizes:
+            sizes = [size for _, _, size in profiler.queue_sizes]
+            print(f"queue size: max {max(sizes)}, last {sizes[-1]}")
+        if args.output is not None:
+            with open(args.output, "w") as file:
+                json.dump(
+                    {"events": profiler.summary(), "queue_sizes": profiler.queue_sizes},
+                    file,
+                    indent=2,
+                )
+    elif args.benchmark == "suite":
+        results = run_suite(
+            args.nodes,
+            args.events,
+            args.lengths,
+            args.queue_sizes,
+            args.repeats,
+            args.legacy_graph_max,
+        )
+        with open(args.output, "w") as file:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "results": results,
+                },
+                file,
+                indent=2,
+            )
+    elif args.benchmark == "compare":
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        with open(args.current) as file:
+            current = json.load(file)
+        rows = compare_results(baseline, current, args.threshold)
+        print(f"{'benchmark':<45} {'baseline':>12} {'current':>12} {'change':>8}")
+        for name, before, after, slowdown, regressed in rows:
+            flag = "  REGRESSION" if regressed else ""
+            print(f"{name:<45} {before:>12.6g} {after:>12.6g} {slowdown:>+8.1%}{flag}")
+        regressions = sum(row[4] for row in rows)
+        if regressions:
+            sys.exit(f"{regressions} benchmarks regressed by more than {args.threshold:.0%}")
+    elif args.benchmark == "startup":
+        seconds, loaded = bench_startup(args.module, args.repeats)
+        print(f"import {args.module}: {seconds * 1000:.0f} ms (median of {args.repeats})")
+        if loaded:
+            sys.exit(f"import {args.module} loaded plotting modules: {', '.join(loaded)}")
+        if args.max_seconds is not None and seconds > args.max_seconds:
+            sys.exit(f"import {args.module} took longer than {args.max_seconds} s")
+    elif args.benchmark == "queue":
+        print(f"{'backend':>10} {'pending':>10} {'ns/op':>10}")
+        for pending in args.pending:
+            for backend in args.backends:
+                ns = bench_queue(backend, pending, args.operations)
+                print(f"{backend:>10} {pending:>10} {ns:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
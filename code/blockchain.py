@@ -1,14 +1,180 @@
 import hashlib
-import matplotlib.pyplot as plt
-import networkx as nx
-from datetime import datetime
+
+import numpy as np
+
+INITIAL_BALANCE = 1200000
+
+
+class BalanceState:
+    # Number of stacked states after which balances are copied into one dict
+    MAX_LAYERS = 32
+
+    def __init__(self, balances=None, parent=None):
+        """
+        Initialize the account balances after a block.
+
+        Parameters:
+        - balances: Balances of the accounts changed by the block.
+        - parent: Balance state of the previous block, None for the genesis block.
+        """
+        self.balances = balances if balances is not None else {}
+        self.parent = parent
+        self.layers = parent.layers + 1 if parent is not None else 1
+
+    def get(self, account_id):
+        """Return the balance of an account."""
+        state = self
+        while state is not None:
+            balance = state.balances.get(account_id)
+            if balance is not None:
+                return balance
+            state = state.parent
+        return INITIAL_BALANCE
+
+    def apply(self, transactions):
+        """Return the state reached by applying transactions on top of this one."""
+        balances = {}
+        for txn in transactions:
+            if txn.sender != -1:
+                balances[txn.sender] = (
+                    balances.get(txn.sender, self.get(txn.sender)) - txn.amount
+                )
+            balances[txn.receiver] = (
+                balances.get(txn.receiver, self.get(txn.receiver)) + txn.amount
+            )
+        if self.layers < self.MAX_LAYERS:
+            return BalanceState(balances, self)
+        # Collapse the stack so that lookups never walk more than MAX_LAYERS
+        flattened = {}
+        state = self
+        while state is not None:
+            for account_id, balance in state.balances.items():
+                flattened.setdefault(account_id, balance)
+            state = state.parent
+        flattened.update(balances)
+        return BalanceState(flattened)
+
+
+def transaction_digest(transaction):
+    """Return the SHA-1 digest of a transaction, a leaf of a block's Merkle tree."""
+    return hashlib.sha1(
+        f"{transaction.txn_id}:{transaction.sender}:{transaction.receiver}:"
+        f"{transaction.amount}".encode()
+    ).digest()
+
+
+class BlockTemplate:
+    def __init__(self, transactions=()):
+        """
+        Initialize the template of the next block a node mines.
+
+        The template keeps the pending transactions and their Merkle root.
+        The tree is kept as the roots of its perfect subtrees, so adding a
+        transaction merges O(1) subtrees on average and the root is
+        available without rehashing the pool. The root does not depend on
+        the parent block, so the template stays valid when the tip changes.
+        Removing transactions rebuilds the tree on the next use.
+
+        Parameters:
+        - transactions: Initial transactions of the template.
+        """
+        self.transactions = {}  # Transactions keyed by ID, in arrival order
+        self._peaks = []  # (height, digest) of the perfect subtrees
+        self._stale = False
+        for transaction in transactions:
+            self.add(transaction)
+
+    def __len__(self):
+        return len(self.transactions)
+
+    def _push(self, digest):
+        peaks = self._peaks
+        height = 0
+        while peaks and peaks[-1][0] == height:
+            digest = hashlib.sha1(peaks.pop()[1] + digest).digest()
+            height += 1
+        peaks.append((height, digest))
+
+    def add(self, transaction):
+        """Add a transaction, returning False if it was already in the template."""
+        if transaction.txn_id in self.transactions:
+            return False
+        self.transactions[transaction.txn_id] = transaction
+        if not self._stale:
+            self._push(transaction_digest(transaction))
+        return True
+
+    def discard(self, txn_id):
+        """Remove a transaction if it is in the template."""
+        if self.transactions.pop(txn_id, None) is not None:
+            self._stale = True
+
+    def clear(self):
+        """Remove every transaction."""
+        self.transactions = {}
+        self._peaks = []
+        self._stale = False
+
+    def merkle_root(self):
+        """Return the Merkle root of the template's transactions."""
+        if self._stale:
+            self._peaks = []
+            self._stale = False
+            for transaction in self.transactions.values():
+                self._push(transaction_digest(transaction))
+        if not self._peaks:
+            return hashlib.sha1().digest()
+        root = self._peaks[-1][1]
+        for _, digest in reversed(self._peaks[:-1]):
+            root = hashlib.sha1(digest + root).digest()
+        return root
 
 
 class Block:
-    def __init__(self, block_id, previous_block_id, transactions):
+    __slots__ = ("block_id", "previous_block_id", "_transactions", "store", "txn_range")
+
+    def __init__(self, block_id, previous_block_id, transactions, store=None):
+        """
+        Initialize a Block object. Blocks are shared by every node that
+        stores them and must not be modified after creation.
+
+        Parameters:
+        - block_id: Unique identifier of the block.
+        - previous_block_id: ID of the parent block, None for the genesis block.
+        - transactions: Transactions included in the block.
+        - store: TransactionStore keeping the transactions in columns, or
+          None to keep them as a tuple of Transaction objects.
+        """
         self.block_id = block_id
         self.previous_block_id = previous_block_id
-        self.transactions = transactions
+        self.store = store
+        if store is None:
+            self._transactions = tuple(transactions)
+            self.txn_range = None
+        else:
+            self._transactions = None
+            self.txn_range = store.extend(transactions)
+
+    @property
+    def transactions(self):
+        """Tuple of the block's transactions, rebuilt from the store if columnar."""
+        if self._transactions is not None:
+            return self._transactions
+        return self.store.get(*self.txn_range)
+
+    @property
+    def num_transactions(self):
+        """Number of transactions in the block."""
+        if self._transactions is not None:
+            return len(self._transactions)
+        start, stop = self.txn_range
+        return stop - start
+
+    def __reduce_ex__(self, protocol):
+        # The genesis block is shared, so it is pickled by reference
+        if self is GENESIS_BLOCK:
+            return "GENESIS_BLOCK"
+        return super().__reduce_ex__(protocol)
 
     def __eq__(self, other):
         return (
@@ -18,107 +184,292 @@ class Block:
         )
 
 
-class Blockchain:
+# Genesis block shared by every blockchain
+GENESIS_BLOCK = Block("0", None, ())
+
+
+class BlockStore:
     def __init__(self):
-        self.genesis_block = Block("0", None, [])
-        self.blocks = [self.genesis_block]
+        """
+        Initialize a store holding every block of a simulation exactly once.
+
+        Blocks are numbered by serial in the order they are registered. For
+        each serial the store keeps the parent's serial, the depth of the
+        block from the genesis block, the balances after the block and the
+        memoized result of validating the block against its parent, so that
+        this work is done once per block rather than once per node.
+        """
+        self.blocks = []
+        self.parents = []  # Serial of the parent block, -1 for roots
+        self.depths = []  # Number of blocks from the genesis block, inclusive
+        self.states = []  # BalanceState after the block
+        self.valid = []  # Validation result, None until first validated
+        self.transaction_blocks = {}  # Transaction ID -> serials of its blocks
+        self._serials = {}  # id(block) -> serial
+        self._ids = {}  # Block ID -> serial of the first block with that ID
+        self.register(GENESIS_BLOCK)
+
+    def __getstate__(self):
+        # Only the blocks, parents and validation results are saved; balances
+        # and indexes are rebuilt from them, and object ids change anyway
+        return {"blocks": self.blocks, "parents": self.parents, "valid": self.valid}
+
+    def __setstate__(self, state):
+        self.blocks = []
+        self.parents = []
+        self.depths = []
+        self.states = []
+        self.valid = []
+        self.transaction_blocks = {}
+        self._serials = {}
+        self._ids = {}
+        # Parents are always registered before their children
+        for block, parent in zip(state["blocks"], state["parents"]):
+            self.register(block, parent if parent >= 0 else None)
+        self.valid = state["valid"]
 
-    def add_block(self, block):
+    def register(self, block, parent=None):
+        """
+        Register a block and return its serial.
+
+        Parameters:
+        - block: Block to register, returned as is if already registered.
+        - parent: Serial of the parent block, looked up by the block's
+          previous block ID when None.
+        """
+        serial = self._serials.get(id(block))
+        if serial is not None:
+            return serial
+        if parent is None and block.previous_block_id is not None:
+            parent = self._ids.get(block.previous_block_id)
+        serial = len(self.blocks)
         self.blocks.append(block)
+        self._serials[id(block)] = serial
+        self._ids.setdefault(block.block_id, serial)
+        transactions = block.transactions
+        if parent is None:
+            # The genesis block, or a block whose parent was never registered
+            self.parents.append(-1)
+            self.depths.append(1)
+            self.states.append(BalanceState().apply(transactions))
+        else:
+            self.parents.append(parent)
+            self.depths.append(self.depths[parent] + 1)
+            self.states.append(self.states[parent].apply(transactions))
+        self.valid.append(None)
+        for txn in transactions:
+            self.transaction_blocks.setdefault(txn.txn_id, []).append(serial)
+        return serial
+
+    def serial(self, block):
+        """Return the serial of a registered block, or None."""
+        return self._serials.get(id(block))
+
+    def find(self, block_id):
+        """Return the serial of the first registered block with an ID, or None."""
+        return self._ids.get(block_id)
+
+    def is_valid(self, serial):
+        """Check that every sender in a block can pay from its parent's balances."""
+        valid = self.valid[serial]
+        if valid is None:
+            parent = self.parents[serial]
+            state = self.states[parent] if parent >= 0 else BalanceState()
+            valid = all(
+                txn.sender == -1 or state.get(txn.sender) >= txn.amount
+                for txn in self.blocks[serial].transactions
+            )
+            self.valid[serial] = valid
+        return valid
+
+
+class Blockchain:
+    # Values of the per-block flags in `_known`
+    UNKNOWN, ORPHAN, CONNECTED = 0, 1, 2
+
+    def __init__(self, transaction_store=None, block_store=None):
+        """
+        Initialize a blockchain holding only the genesis block.
+
+        A blockchain is one node's view of a BlockStore: it only keeps a flag
+        per block serial telling whether the node has the block and whether
+        the block's chain reaches the genesis block, plus the tip of its
+        longest chain.
+
+        Parameters:
+        - transaction_store: TransactionStore for the transactions of blocks
+          created by this blockchain, None to keep them in the blocks.
+        - block_store: BlockStore shared with other nodes, None for a
+          private one.
+        """
+        self.genesis_block = GENESIS_BLOCK
+        self.transaction_store = transaction_store
+        self.store = block_store if block_store is not None else BlockStore()
+        self._known = bytearray(1)
+        self._known[0] = self.CONNECTED
+        # (insertion order, serial) of stored blocks waiting for their parent,
+        # keyed by parent
+        self._orphans = {}
+        self._tip = 0
+        self._tip_order = 0  # Insertion order of the tip, to break ties
+        self._size = 1
+        self._created = 0  # Number of blocks created by create_block
+
+    @property
+    def blocks(self):
+        """List of the stored blocks, in the order they were registered."""
+        known = np.flatnonzero(np.frombuffer(self._known, dtype=np.uint8))
+        return [self.store.blocks[serial] for serial in known.tolist()]
+
+    def __len__(self):
+        return self._size
+
+    def block_flags(self):
+        """Return a copy of the UNKNOWN, ORPHAN or CONNECTED flag of every block serial."""
+        return np.frombuffer(bytes(self._known), dtype=np.uint8)
+
+    def _flag(self, serial):
+        return self._known[serial] if serial < len(self._known) else self.UNKNOWN
+
+    def add_block(self, block, parent=None):
+        """
+        Store a block and update the longest chain tip.
 
-    def create_block(self, transactions, node_id):
-        # Create a new block with transactions
-        transactions_string = "".join(
-            [
-                str(txn.sender) + str(txn.receiver) + str(txn.amount)
-                for txn in transactions[:-1]
-            ]
+        A block only counts towards the longest chain once all of its
+        ancestors are stored. Of equally long chains, the one whose tip was
+        stored first stays the longest. Returns False if the block was
+        already stored.
+        """
+        serial = self.store.register(block, parent)
+        if self._flag(serial) != self.UNKNOWN:
+            return False
+        if serial >= len(self._known):
+            self._known.extend(bytes(max(serial + 1 - len(self._known), len(self._known))))
+        order = self._size
+        self._size += 1
+        parent = self.store.parents[serial]
+        if parent >= 0 and self._flag(parent) != self.CONNECTED:
+            self._known[serial] = self.ORPHAN
+            self._orphans.setdefault(parent, []).append((order, serial))
+            return True
+
+        # Connect the block, then any orphans that were waiting on it
+        depths = self.store.depths
+        pending = [(order, serial)]
+        while pending:
+            order, serial = pending.pop()
+            self._known[serial] = self.CONNECTED
+            depth, tip_depth = depths[serial], depths[self._tip]
+            if depth > tip_depth or (depth == tip_depth and order < self._tip_order):
+                self._tip = serial
+                self._tip_order = order
+            pending.extend(self._orphans.pop(serial, ()))
+        return True
+
+    def contains(self, block):
+        """Check if a block is already stored."""
+        serial = self.store.serial(block)
+        return serial is not None and self._flag(serial) != self.UNKNOWN
+
+    def contains_transaction(self, txn_id):
+        """Check if a transaction is in any stored block."""
+        return any(
+            self._flag(serial) != self.UNKNOWN
+            for serial in self.store.transaction_blocks.get(txn_id, ())
         )
-        block_id = hashlib.sha1(transactions_string.encode()).hexdigest()
 
-        if not self.blocks:
-            previous_block_id = None
-        else:
-            longest_chain = self.get_longest_chain()
-            previous_block_id = longest_chain[-1].block_id if longest_chain else None
+    def is_valid(self, block):
+        """Check if a block is valid on top of its parent."""
+        return self.store.is_valid(self.store.register(block))
 
-        new_block = Block(block_id, previous_block_id, transactions)
-        self.blocks.append(new_block)
+    def create_block(self, transactions, node_id, merkle_root=None):
+        """
+        Create a block on top of the tip and store it.
+
+        The block ID hashes the parent's ID, the miner, the number of blocks
+        this blockchain created and the Merkle root of the transactions
+        without the reward, so no two blocks share an ID.
+
+        Parameters:
+        - transactions: Transactions of the block, ending with the reward.
+        - node_id: ID of the mining node.
+        - merkle_root: Merkle root of transactions[:-1] if already known,
+          such as from the node's BlockTemplate.
+        """
+        if merkle_root is None:
+            merkle_root = BlockTemplate(transactions[:-1]).merkle_root()
+        tip = self.get_tip()
+        self._created += 1
+        block_id = hashlib.sha1(
+            f"{tip.block_id}:{node_id}:{self._created}:".encode() + merkle_root
+        ).hexdigest()
+        new_block = Block(block_id, tip.block_id, transactions, self.transaction_store)
+        self.add_block(new_block, parent=self._tip)
         return new_block
 
+    def get_tip(self):
+        """Return the last block of the longest chain."""
+        return self.store.blocks[self._tip]
+
+    def get_height(self):
+        """Return the length of the longest chain."""
+        return self.store.depths[self._tip]
+
+    def get_depth(self, block):
+        """Return the length of the chain ending at a block."""
+        serial = self.store.serial(block)
+        return self.store.depths[serial] if serial is not None else None
+
+    def get_tip_state(self):
+        """Return the balances at the tip of the longest chain."""
+        return self.store.states[self._tip]
+
+    def get_reorg_depth(self, old_tip):
+        """Return how many blocks of the chain ending at `old_tip` are not on the longest chain."""
+        parents, depths = self.store.parents, self.store.depths
+        old, new = self.store.serial(old_tip), self._tip
+        depth = 0
+        while old != new and old >= 0 and new >= 0:
+            if depths[old] >= depths[new]:
+                old = parents[old]
+                depth += 1
+            else:
+                new = parents[new]
+        return depth
+
     def get_longest_chain(self):
+        blocks, parents = self.store.blocks, self.store.parents
+        serial = self._tip
         longest_chain = []
-        for block in self.blocks:
-            current_chain = [block]
-            while current_chain[-1].previous_block_id is not None:
-                prev_block = self.find_block_by_id(current_chain[-1].previous_block_id)
-                if prev_block:
-                    current_chain.append(prev_block)
-                else:
-                    break
-            if len(current_chain) > len(longest_chain):
-                longest_chain = current_chain
+        while serial >= 0:
+            longest_chain.append(blocks[serial])
+            serial = parents[serial]
         return longest_chain[::-1]
 
     def find_block_by_id(self, block_id):
-        for block in self.blocks:
-            if block.block_id == block_id:
-                return block
-        return None
-
-    def visualize(self, node_id):
-        G = nx.DiGraph()
-
-        for block in self.blocks:
-            G.add_node(block.block_id)
-            if block.previous_block_id:
-                G.add_edge(block.previous_block_id, block.block_id)
-
-        block_info = {block.block_id: block for block in self.blocks}
-
-        plt.figure(figsize=(20, 10))  # Full screen mode
-        pos = nx.kamada_kawai_layout(G)
-
-        # Draw nodes for each block
-        for i, node in enumerate(G.nodes()):
-            block = block_info[node]
-            nx.draw_networkx_nodes(
-                G,
-                pos,
-                nodelist=[node],
-                node_size=1000,
-                node_color="red" if block.block_id == "0" else "lightgreen",
-                edgecolors="black",
-            )
+        serial = self.store.find(block_id)
+        if serial is None or self._flag(serial) == self.UNKNOWN:
+            return None
+        return self.store.blocks[serial]
 
-            label = f"{block.block_id}"
-            nx.draw_networkx_labels(
-                G, pos, labels={node: label}, font_size=1, font_weight="bold"
-            )
+    def visualize(self, node_id, path=None):
+        """
+        Draw the block tree of the blockchain, see render.draw_blockchain.
 
-        for edge in G.edges():
-            x_start, y_start = pos[edge[0]]
-            x_end, y_end = pos[edge[1]]
-            x_mid = (x_start + x_end) / 2
-            y_mid = (y_start + y_end) / 2
-            arrow_pos = (x_mid, y_mid)
-            nx.draw_networkx_edges(
-                G,
-                pos,
-                edgelist=[edge],
-                width=1.0,
-                arrowsize=20,
-                arrowstyle="-|>",
-                # connectionstyle=f"arc3,rad=0.1",
-                ax=plt.gca(),
-            )
-            plt.gca().annotate(
-                "",
-                xy=(x_mid, y_mid),
-                xytext=(x_start, y_start),
-                arrowprops=dict(arrowstyle="->", color="black"),
-            )
+        Parameters:
+        - node_id: ID of the node owning the blockchain, used in the title.
+        - path: Image file to write without opening a window, None to show
+          the tree interactively.
+        """
+        # Plotting libraries are only loaded when a visualization is requested
+        from render import draw_blockchain, render_blockchain
+
+        title = f"Peer {node_id}'s Blockchain Visualization"
+        if path is not None:
+            render_blockchain(self, path, title)
+            return
+        import matplotlib.pyplot as plt
 
-        plt.title(f"Peer {node_id}'s Blockchain Visualization")
-        plt.axis("off")
+        figure, ax = plt.subplots(figsize=(20, 10))
+        draw_blockchain(self, ax, title)
         plt.show()
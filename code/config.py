@@ -0,0 +1,204 @@
+import os
+
+from event import QUEUE_BACKENDS
+from export import FORMATS
+from topology import TOPOLOGIES
+
+# Settings of a run and their defaults. Config files and command-line options
+# use the same names, with dashes or underscores.
+DEFAULTS = {
+    # Network
+    "peers": None,
+    "z0": None,
+    "z1": None,
+    "transaction_mean_gap": None,
+    "min_transactions_per_mining": 10,
+    "topology": "random",
+    "seed": None,
+    "inventory_interval": 20,
+    "columnar_transactions": False,
+    # Run
+    "max_events": 10000,
+    "until_time": None,
+    "queue_backend": "heap",
+    "workers": None,
+    "checkpoint": None,
+    "checkpoint_every": None,
+    "resume": None,
+    # Outputs
+    "trace": None,
+    "metrics": None,
+    "profile": False,
+    "folded": None,
+    "print_blockchain": None,
+    "export": None,
+    "export_format": "jsonl",
+    "export_every": None,
+    "render": None,
+    "render_format": "png",
+    "render_nodes": None,
+}
+REQUIRED = ("peers", "z0", "z1", "transaction_mean_gap")
+# Type of every setting: int, float, bool, str (paths and names) or list,
+# a list of node IDs. float settings also take integers
+TYPES = {
+    "peers": int,
+    "z0": float,
+    "z1": float,
+    "transaction_mean_gap": float,
+    "min_transactions_per_mining": int,
+    "topology": str,
+    "seed": int,
+    "inventory_interval": float,
+    "columnar_transactions": bool,
+    "max_events": int,
+    "until_time": float,
+    "queue_backend": str,
+    "workers": int,
+    "checkpoint": str,
+    "checkpoint_every": int,
+    "resume": str,
+    "trace": str,
+    "metrics": str,
+    "profile": bool,
+    "folded": str,
+    "print_blockchain": str,
+    "export": str,
+    "export_format": str,
+    "export_every": int,
+    "render": str,
+    "render_format": str,
+    "render_nodes": list,
+}
+# Default paths of the outputs that a config file can also turn on with true
+FLAG_PATHS = {"print_blockchain": "blockchain.txt", "render": "blockchains"}
+TYPE_NAMES = {int: "an integer", float: "a number", bool: "true or false", str: "a string"}
+# Allowed values of the settings that name an implementation
+CHOICES = {
+    "topology": TOPOLOGIES,
+    "queue_backend": QUEUE_BACKENDS,
+    "export_format": FORMATS,
+}
+
+
+def load_config(path):
+    """
+    Load the settings of a run from a TOML or YAML file.
+
+    The file holds a flat table of settings named as in DEFAULTS, such as
+    `peers = 1000` or `until-time: 5000`. TOML files are read with tomllib,
+    YAML files (.yaml or .yml) need PyYAML.
+
+    Parameters:
+    - path: Path of the config file.
+
+    Returns a dict of the settings in the file.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".toml":
+        import tomllib
+
+        with open(path, "rb") as file:
+            data = tomllib.load(file)
+    elif extension in (".yaml", ".yml"):
+        # PyYAML is only needed for YAML config files
+        import yaml
+
+        with open(path) as file:
+            data = yaml.safe_load(file) or {}
+    else:
+        raise ValueError(f"Unknown config format {extension!r}, expected .toml, .yaml or .yml")
+    if not isinstance(data, dict):
+        raise ValueError(f"{path} must hold a table of settings")
+
+    config = {}
+    for key, value in data.items():
+        name = key.replace("-", "_")
+        if name not in DEFAULTS:
+            raise ValueError(f"Unknown setting {key!r} in {path}")
+        config[name] = value
+    return config
+
+
+def check_type(name, value):
+    """
+    Check the type of a setting, as read from a config file or the command line.
+
+    Parameters:
+    - name: Name of the setting in DEFAULTS.
+    - value: Value of the setting, None for not set.
+
+    Returns the value, with integers of float settings converted to floats
+    and true or false for the outputs of FLAG_PATHS turned into their
+    default path or None. Raises ValueError for a value of another type.
+    """
+    kind = TYPES[name]
+    if value is None:
+        return None
+    if name in FLAG_PATHS and isinstance(value, bool):
+        return FLAG_PATHS[name] if value else None
+    if kind is list:
+        valid = isinstance(value, list) and all(
+            isinstance(item, int) and not isinstance(item, bool) for item in value
+        )
+        if not valid:
+            raise ValueError(f"Setting {name} must be a list of node IDs, got {value!r}")
+        return value
+    if kind is float and isinstance(value, int) and not isinstance(value, bool):
+        return float(value)
+    if not isinstance(value, kind) or (kind is not bool and isinstance(value, bool)):
+        raise ValueError(f"Setting {name} must be {TYPE_NAMES[kind]}, got {value!r}")
+    return value
+
+
+def resolve(config, overrides):
+    """
+    Merge the settings of a run, from lowest to highest priority: DEFAULTS,
+    a config file and command-line options.
+
+    Parameters:
+    - config: Settings from a config file.
+    - overrides: Settings given on the command line, None where not given.
+
+    Returns a dict with every setting of DEFAULTS. Raises ValueError for
+    settings of the wrong type or with unknown values, and for missing
+    required settings.
+    """
+    settings = dict(DEFAULTS)
+    settings.update(config)
+    settings.update({name: value for name, value in overrides.items() if value is not None})
+    for name, value in settings.items():
+        settings[name] = check_type(name, value)
+    for name, choices in CHOICES.items():
+        if settings[name] not in choices:
+            raise ValueError(
+                f"Unknown {name} {settings[name]!r}, expected one of {sorted(choices)}"
+            )
+    if settings["resume"] is None:
+        missing = [name for name in REQUIRED if settings[name] is None]
+        if missing:
+            raise ValueError(
+                "Missing settings: "
+                + ", ".join("--" + name.replace("_", "-") for name in missing)
+            )
+    return settings
+
+
+def simulator_options(settings):
+    """Return the keyword arguments of the Simulator for the settings of a run."""
+    return {
+        "n": settings["peers"],
+        "z0": settings["z0"],
+        "z1": settings["z1"],
+        "min_transactions_per_mining": settings["min_transactions_per_mining"],
+        "transaction_mean_gap": settings["transaction_mean_gap"],
+        "max_events": settings["max_events"],
+        "queue_backend": settings["queue_backend"],
+        "seed": settings["seed"],
+        "topology": settings["topology"],
+        "columnar_transactions": settings["columnar_transactions"],
+        "trace_path": settings["trace"],
+        "metrics": settings["metrics"] is not None,
+        "inventory_interval": settings["inventory_interval"],
+        "profile": settings["profile"],
+    }
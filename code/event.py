@@ -1,4 +1,6 @@
+import bisect
 import heapq
+from itertools import count
 
 
 class Event:
@@ -35,30 +37,193 @@ class Event:
 
     def __ge__(self, other):
         """Define greater than or equal comparison based on event time."""
-        return self.time >= other.times
+        return self.time >= other.time
 
     def __str__(self) -> str:
         """Return a string representation of the event."""
         return f"Object: {self.object}, Function: {self.function}, Params: {self.params}, Time: {self.time}"
 
+    def fire(self):
+        """Call the event's function on its object."""
+        if hasattr(self.object, self.function):
+            method = getattr(self.object, self.function)
+            if self.params is None:
+                method()
+            elif isinstance(self.params, dict):
+                method(**self.params)
+            else:
+                method(*self.params)
+
 
 class EventPriorityQueue:
     def __init__(self):
-        """Initialize an empty priority queue for events."""
+        """
+        Initialize an empty priority queue for events.
+
+        Events are stored as (time, seq, handler, args) tuples, where handler
+        is a bound method called as handler(*args). The sequence number
+        breaks ties between events at the same time in scheduling order, so
+        handlers and arguments are never compared.
+        """
         self._queue = []
+        self._seq = count()
+
+    def schedule(self, time, handler, args=()):
+        """Schedule handler(*args) to run at the given time."""
+        heapq.heappush(self._queue, (time, next(self._seq), handler, args))
+
+    def pop_entry(self):
+        """Pop the (time, seq, handler, args) tuple with the smallest time."""
+        return heapq.heappop(self._queue)
+
+    def peek_entry(self):
+        """Return the tuple with the smallest time without removing it."""
+        return self._queue[0] if self._queue else None
 
     def push(self, event):
         """Push an event into the priority queue."""
-        heapq.heappush(self._queue, event)
+        self.schedule(event.time, event.fire)
 
     def pop(self):
         """Pop the event with the smallest time from the priority queue."""
-        return heapq.heappop(self._queue)
+        return self._to_event(self.pop_entry())
 
     def peek(self):
         """Return the event with the smallest time without removing it from the priority queue."""
-        return self._queue[0] if self._queue else None
+        entry = self.peek_entry()
+        return self._to_event(entry) if entry is not None else None
 
     def is_empty(self):
         """Check if the priority queue is empty."""
-        return len(self._queue) == 0
+        return len(self) == 0
+
+    def __len__(self):
+        return len(self._queue)
+
+    @staticmethod
+    def _to_event(entry):
+        """Convert a queue entry back into an Event object."""
+        time, _, handler, args = entry
+        owner = getattr(handler, "__self__", None)
+        if isinstance(owner, Event) and handler.__name__ == "fire":
+            return owner
+        return Event(owner, handler.__name__, args, time)
+
+
+class CalendarQueue(EventPriorityQueue):
+    # Number of earliest events used to estimate the bucket width
+    SAMPLE_SIZE = 25
+
+    def __init__(self):
+        """
+        Initialize an empty calendar queue for events.
+
+        Entries are hashed by time into a ring of buckets that each cover
+        `width` time units, and every bucket is kept sorted. Dequeuing scans
+        forward from the bucket of the last dequeued event, so both enqueue
+        and dequeue take O(1) amortized time when the bucket width matches
+        the spacing between pending events. The ring is rebuilt with a new
+        width whenever the number of events doubles or halves.
+        """
+        self._seq = count()
+        self._size = 0
+        self._width = 1.0
+        self._cursor = 0
+        self._set_buckets(2)
+
+    def _set_buckets(self, nbuckets):
+        """Allocate empty buckets and the thresholds for the next resize."""
+        self._nbuckets = nbuckets
+        self._buckets = [[] for _ in range(nbuckets)]
+        self._grow_at = 2 * nbuckets
+        self._shrink_at = nbuckets // 2 if nbuckets > 2 else -1
+
+    def schedule(self, time, handler, args=()):
+        """Schedule handler(*args) to run at the given time."""
+        entry = (time, next(self._seq), handler, args)
+        slot = int(time // self._width)
+        bisect.insort(self._buckets[slot % self._nbuckets], entry)
+        if slot < self._cursor:
+            self._cursor = slot
+        self._size += 1
+        if self._size > self._grow_at:
+            self._resize(2 * self._nbuckets)
+
+    def _find(self):
+        """Return the bucket holding the earliest entry and move the cursor to it."""
+        buckets = self._buckets
+        nbuckets = self._nbuckets
+        width = self._width
+        cursor = self._cursor
+        for _ in range(nbuckets):
+            bucket = buckets[cursor % nbuckets]
+            if bucket and bucket[0][0] < (cursor + 1) * width:
+                self._cursor = cursor
+                return bucket
+            cursor += 1
+        # No event within a full year of buckets, so the width no longer fits
+        # the spacing of pending events; re-estimate it and start over
+        self._resize(nbuckets)
+        bucket = min((b for b in self._buckets if b), key=lambda b: b[0])
+        self._cursor = int(bucket[0][0] // self._width)
+        return bucket
+
+    def pop_entry(self):
+        """Pop the (time, seq, handler, args) tuple with the smallest time."""
+        if not self._size:
+            raise IndexError("pop from an empty calendar queue")
+        entry = self._find().pop(0)
+        self._size -= 1
+        if self._size < self._shrink_at:
+            self._resize(self._nbuckets // 2)
+        return entry
+
+    def peek_entry(self):
+        """Return the tuple with the smallest time without removing it."""
+        return self._find()[0] if self._size else None
+
+    def __len__(self):
+        return self._size
+
+    def _resize(self, nbuckets):
+        """Redistribute all entries over `nbuckets` buckets with a new width."""
+        entries = [entry for bucket in self._buckets for entry in bucket]
+        sample = heapq.nsmallest(self.SAMPLE_SIZE, entries)
+        self._width = self._estimate_width(sample) or self._width
+        self._set_buckets(nbuckets)
+        width = self._width
+        buckets = self._buckets
+        for entry in entries:
+            buckets[int(entry[0] // width) % nbuckets].append(entry)
+        for bucket in buckets:
+            if len(bucket) > 1:
+                bucket.sort()
+        self._cursor = int(sample[0][0] // width) if sample else 0
+
+    @staticmethod
+    def _estimate_width(sample):
+        """Estimate a bucket width from the gaps between the earliest entries."""
+        gaps = [b[0] - a[0] for a, b in zip(sample, sample[1:])]
+        if not gaps:
+            return None
+        average = sum(gaps) / len(gaps)
+        # Ignore gaps much larger than average, as in Brown's calendar queue
+        gaps = [gap for gap in gaps if gap <= 2 * average]
+        average = sum(gaps) / len(gaps) if gaps else average
+        return 3 * average
+
+
+# Queue implementations selectable through Simulator(queue_backend=...)
+QUEUE_BACKENDS = {
+    "heap": EventPriorityQueue,
+    "calendar": CalendarQueue,
+}
+
+
+def make_queue(backend="heap"):
+    """Create an empty event queue of the given backend."""
+    if backend not in QUEUE_BACKENDS:
+        raise ValueError(
+            f"Unknown queue backend {backend!r}, expected one of {sorted(QUEUE_BACKENDS)}"
+        )
+    return QUEUE_BACKENDS[backend]()
@@ -0,0 +1,285 @@
+import gzip
+import json
+
+import numpy as np
+
+MAGIC = b"BCEXPRT1"
+
+# Records of the binary format, written in frames of one kind each
+BLOCK_DTYPE = np.dtype(
+    [
+        ("serial", "<i8"),
+        ("parent", "<i8"),  # Serial of the parent block, -1 if unknown
+        ("depth", "<i4"),
+        ("num_transactions", "<i4"),
+        ("block_id", "S40"),
+        ("previous_block_id", "S40"),
+    ]
+)
+TRANSACTION_DTYPE = np.dtype(
+    [
+        ("block", "<i8"),  # Serial of the block holding the transaction
+        ("txn_id", "<i8"),
+        ("sender", "<i8"),
+        ("receiver", "<i8"),
+        ("amount", "<i8"),
+        ("timestamp", "<f8"),
+    ]
+)
+MEMBERSHIP_DTYPE = np.dtype([("node", "<i4"), ("serial", "<i8"), ("time", "<f8")])
+TIP_DTYPE = np.dtype(
+    [("node", "<i4"), ("serial", "<i8"), ("height", "<i4"), ("time", "<f8")]
+)
+FRAMES = {
+    b"B": ("blocks", BLOCK_DTYPE),
+    b"T": ("transactions", TRANSACTION_DTYPE),
+    b"M": ("memberships", MEMBERSHIP_DTYPE),
+    b"P": ("tips", TIP_DTYPE),
+}
+FRAME_DTYPES = {name: dtype for name, dtype in FRAMES.values()}
+FORMATS = {"jsonl", "binary"}
+
+
+def infer_compression(path):
+    """Return the compression implied by a file name: "gzip", "zstd" or None."""
+    if path.endswith(".gz"):
+        return "gzip"
+    if path.endswith(".zst"):
+        return "zstd"
+    return None
+
+
+def open_file(path, mode, compression):
+    """Open a file for binary reading or writing through a compressor."""
+    if compression == "gzip":
+        return gzip.open(path, mode)
+    if compression == "zstd":
+        # zstandard is only needed for .zst files
+        import zstandard
+
+        file = open(path, mode)
+        if "w" in mode:
+            return zstandard.ZstdCompressor().stream_writer(file)
+        return zstandard.ZstdDecompressor().stream_reader(file)
+    if compression is None:
+        return open(path, mode)
+    raise ValueError(f"Unknown compression {compression!r}")
+
+
+class BlockchainExporter:
+    def __init__(self, path, format="jsonl", compression="infer"):
+        """
+        Initialize a streaming export of the blockchains of a simulation.
+
+        Blocks are shared by the nodes, so every block is written once, and
+        each node only gets membership records naming the serials of the
+        blocks it stored, plus a record of its tip. export() can be called
+        any number of times during a run; each call writes what changed
+        since the previous one in a single write.
+
+        In the "jsonl" format every line is a JSON object with a "type" of
+        "header", "block", "membership" or "tip". The "binary" format starts
+        with MAGIC and a length-prefixed JSON header, followed by frames of
+        a one-letter kind from FRAMES, a little-endian uint64 record count
+        and packed records.
+
+        Parameters:
+        - path: Path of the export file, overwritten if it exists.
+        - format: "jsonl" or "binary".
+        - compression: "gzip", "zstd", None, or "infer" to use the file
+          name's .gz or .zst suffix.
+        """
+        if format not in FORMATS:
+            raise ValueError(f"Unknown format {format!r}, expected one of {sorted(FORMATS)}")
+        if compression == "infer":
+            compression = infer_compression(path)
+        self.path = path
+        self.format = format
+        self._file = open_file(path, "wb", compression)
+        self._blocks_written = 0
+        self._flags = {}  # Node ID -> block flags at the previous export
+        self._tips = {}  # Node ID -> tip serial at the previous export
+        self._header_written = False
+
+    def _write_header(self, simulator):
+        header = {"version": 1, "nodes": len(simulator.nodes)}
+        if self.format == "jsonl":
+            self._file.write((json.dumps({"type": "header", **header}) + "\n").encode())
+        else:
+            header["frames"] = {
+                kind.decode(): [name, dtype.descr] for kind, (name, dtype) in FRAMES.items()
+            }
+            data = json.dumps(header).encode()
+            self._file.write(MAGIC + len(data).to_bytes(4, "little") + data)
+        self._header_written = True
+
+    def _changes(self, simulator):
+        """Return the new blocks, memberships and tips since the last export."""
+        store = simulator.block_store
+        blocks = range(self._blocks_written, len(store.blocks))
+        self._blocks_written = len(store.blocks)
+        memberships = []
+        tips = []
+        for node in simulator.nodes:
+            flags = node.blockchain.block_flags()
+            previous = self._flags.get(node.id)
+            known = flags != 0
+            if previous is not None:
+                # Flags only grow, and a stored block is never forgotten
+                known[: len(previous)] &= previous == 0
+            self._flags[node.id] = flags
+            serials = np.flatnonzero(known)
+            if len(serials):
+                memberships.append((node.id, serials))
+            tip = store.serial(node.blockchain.get_tip())
+            if self._tips.get(node.id) != tip:
+                self._tips[node.id] = tip
+                tips.append((node.id, tip, node.blockchain.get_height()))
+        return blocks, memberships, tips
+
+    def export(self, simulator):
+        """Write the blocks, memberships and tips that changed since the last export."""
+        if not self._header_written:
+            self._write_header(simulator)
+        blocks, memberships, tips = self._changes(simulator)
+        time = simulator.current_time
+        if self.format == "jsonl":
+            data = self._jsonl(simulator.block_store, blocks, memberships, tips, time)
+        else:
+            data = self._binary(simulator.block_store, blocks, memberships, tips, time)
+        self._file.write(data)
+
+    def _jsonl(self, store, blocks, memberships, tips, time):
+        lines = []
+        for serial in blocks:
+            block = store.blocks[serial]
+            lines.append(
+                json.dumps(
+                    {
+                        "type": "block",
+                        "serial": serial,
+                        "id": block.block_id,
+                        "previous_id": block.previous_block_id,
+                        "parent": store.parents[serial],
+                        "depth": store.depths[serial],
+                        "transactions": [
+                            [txn.txn_id, txn.sender, txn.receiver, txn.amount, txn.timestamp]
+                            for txn in block.transactions
+                        ],
+                    }
+                )
+            )
+        for node_id, serials in memberships:
+            lines.append(
+                json.dumps(
+                    {
+                        "type": "membership",
+                        "node": node_id,
+                        "time": time,
+                        "serials": serials.tolist(),
+                    }
+                )
+            )
+        for node_id, serial, height in tips:
+            lines.append(
+                json.dumps(
+                    {
+                        "type": "tip",
+                        "node": node_id,
+                        "time": time,
+                        "serial": serial,
+                        "height": height,
+                    }
+                )
+            )
+        return "".join(line + "\n" for line in lines).encode()
+
+    def _binary(self, store, blocks, memberships, tips, time):
+        block_records = np.zeros(len(blocks), dtype=BLOCK_DTYPE)
+        transactions = []
+        for row, serial in enumerate(blocks):
+            block = store.blocks[serial]
+            block_transactions = block.transactions
+            block_records[row] = (
+                serial,
+                store.parents[serial],
+                store.depths[serial],
+                len(block_transactions),
+                block.block_id.encode(),
+                (block.previous_block_id or "").encode(),
+            )
+            transactions += [
+                (serial, txn.txn_id, txn.sender, txn.receiver, txn.amount, txn.timestamp)
+                for txn in block_transactions
+            ]
+        membership_records = np.zeros(
+            sum(len(serials) for _, serials in memberships), dtype=MEMBERSHIP_DTYPE
+        )
+        start = 0
+        for node_id, serials in memberships:
+            rows = membership_records[start : start + len(serials)]
+            rows["node"] = node_id
+            rows["serial"] = serials
+            start += len(serials)
+        membership_records["time"] = time
+        frames = [
+            (b"B", block_records),
+            (b"T", np.array(transactions, dtype=TRANSACTION_DTYPE)),
+            (b"M", membership_records),
+            (
+                b"P",
+                np.array(
+                    [(node_id, serial, height, time) for node_id, serial, height in tips],
+                    dtype=TIP_DTYPE,
+                ),
+            ),
+        ]
+        parts = []
+        for kind, records in frames:
+            if len(records):
+                parts += [kind, len(records).to_bytes(8, "little"), records.tobytes()]
+        return b"".join(parts)
+
+    def close(self):
+        """Finish the compressed stream and close the file."""
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_jsonl(path, compression="infer"):
+    """Yield the records of a JSONL export as dicts."""
+    if compression == "infer":
+        compression = infer_compression(path)
+    with open_file(path, "rb", compression) as file:
+        for line in file:
+            yield json.loads(line)
+
+
+def read_binary(path, compression="infer"):
+    """Return the records of a binary export as a dict of arrays named as in FRAMES."""
+    if compression == "infer":
+        compression = infer_compression(path)
+    with open_file(path, "rb", compression) as file:
+        data = file.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{path} is not a binary blockchain export")
+    offset = len(MAGIC)
+    header_length = int.from_bytes(data[offset : offset + 4], "little")
+    offset += 4 + header_length
+    chunks = {name: [] for name, _ in FRAMES.values()}
+    while offset < len(data):
+        name, dtype = FRAMES[data[offset : offset + 1]]
+        count = int.from_bytes(data[offset + 1 : offset + 9], "little")
+        offset += 9
+        chunks[name].append(np.frombuffer(data, dtype=dtype, count=count, offset=offset))
+        offset += count * dtype.itemsize
+    return {
+        name: np.concatenate(arrays) if arrays else np.zeros(0, dtype=FRAME_DTYPES[name])
+        for name, arrays in chunks.items()
+    }
+
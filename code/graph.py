@@ -1,12 +1,15 @@
-import random
-import networkx as nx
-import matplotlib.pyplot as plt
+import numpy as np
 import sys
 
-def generate_graph(n, min_edges=random.choice([3, 4, 5, 6])):
+def generate_graph(n, min_edges=None, rng=None):
     """
     Function to generate a random graph with 'n' nodes and at least 'min_edges' edges per node.
+    'min_edges' is drawn from 3 to 6 when not given, and 'rng' is the numpy Generator used.
     """
+    if rng is None:
+        rng = np.random.default_rng()
+    if min_edges is None:
+        min_edges = int(rng.integers(3, 7))
     graph = [[False] * n for _ in range(n)]  # Initialize an empty adjacency matrix
     indices = [i for i in range(n)]  # List of node indices
     for i in range(n):
@@ -25,9 +28,9 @@ def generate_graph(n, min_edges=random.choice([3, 4, 5, 6])):
             copy.remove(i)  # Remove the current node from the list of available nodes
         # Randomly select nodes to connect with node i until the minimum edge requirement is met
         while k != 0 and copy:
-            choice = random.choice(
-                copy
-            )  # Randomly choose a node to connect with node i
+            choice = copy[
+                rng.integers(len(copy))
+            ]  # Randomly choose a node to connect with node i
             if not graph[i][choice]:
                 graph[i][choice] = True  # Connect node i with the chosen node
                 graph[choice][i] = True  # Make the connection bidirectional
@@ -51,6 +54,10 @@ def visualize_graph(graph):
     """
     Function to visualize a graph using NetworkX and Matplotlib.
     """
+    # Plotting libraries are only loaded when a visualization is requested
+    import matplotlib.pyplot as plt
+    import networkx as nx
+
     G = nx.Graph()
     # Add edges to the graph based on the adjacency matrix
     for i, row in enumerate(graph):
@@ -64,35 +71,35 @@ def visualize_graph(graph):
 
 def is_connected(graph):
     """
-    Function to check if a graph is connected using Depth-First Search (DFS).
+    Function to check if a graph is connected using an iterative Depth-First Search (DFS).
     """
-
-    def dfs(node):
-        visited[node] = True
-        # Traverse all neighbors of the current node
-        for neighbor in range(len(graph)):
-            if graph[node][neighbor] and not visited[neighbor]:
-                dfs(
-                    neighbor
-                )  # Recursively explore the neighbor if it has not been visited
-
     visited = [False] * len(graph)  # Initialize visited array
-    dfs(0)  # Start DFS from node 0
+    visited[0] = True
+    stack = [0]  # Start DFS from node 0
+    while stack:
+        node = stack.pop()
+        # Traverse all neighbors of the current node
+        for neighbor, connected in enumerate(graph[node]):
+            if connected and not visited[neighbor]:
+                visited[neighbor] = True
+                stack.append(neighbor)
     # Check if all nodes were visited
     return all(visited)
 
 
-def generate_connected_graph(n):
+def generate_connected_graph(n, rng=None):
     """
-    Function to generate a connected graph with 'n' nodes.
+    Function to generate a connected graph with 'n' nodes, using the numpy Generator 'rng'.
     """
+    if rng is None:
+        rng = np.random.default_rng()
     while True:
-        graph = generate_graph(n)  # Generate a random graph
+        graph = generate_graph(n, rng=rng)  # Generate a random graph
         if is_connected(graph):  # Check if the graph is connected
             return graph  # Return the connected graph
 
 
 # Call the functions
-if sys.argv[1] == "--generate":
+if __name__ == "__main__" and sys.argv[1:2] == ["--generate"]:
     graph = generate_graph(10)  # Generate a random graph with 10 nodes
     visualize_graph(graph)  # Visualize the graph
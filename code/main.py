@@ -1,40 +1,217 @@
+import argparse  # Importing argparse for command-line options
+import json  # Importing json for the results of parallel runs
+import math
+
+from config import CHOICES, FLAG_PATHS, load_config, resolve, simulator_options
 from simulator import Simulator  # Importing the Simulator class from simulator module
-import sys  # Importing the sys module for command-line arguments
 
-# Main function
-if __name__ == "__main__":
-    # Creating an instance of Simulator with parameters extracted from command-line arguments
-    simulator = Simulator(
-        int(sys.argv[2]),  # Number of nodes
-        float(sys.argv[4]),  # z0
-        float(sys.argv[6]),  # z1
-        min_transactions_per_mining=10,  # Minimum transactions per mining
-        transaction_mean_gap=int(sys.argv[8]),  # Transaction mean gap
-        max_events=10000,  # Maximum number of events
-    )
-
-    # Running the simulation
-    simulator.simulate()
-
-    # Printing the blockchain if "--print-blockchain" is in command-line arguments
-    if "--print-blockchain" in sys.argv:
-        simulator.print_blockchain()
-        print("Blockchain written to file `blockchain.txt`")
-
-    # Visualizing the blockchain if "--visualize-blockchain" is in command-line arguments
-    if "--visualize-blockchain" in sys.argv:
-        index = input("Enter the index of the node you want to visualize: ")
-        if index.isdigit():
-            index = int(index)
-            # Checking if the entered index is within the range of nodes
-            if index < len(simulator.nodes):
-                # Visualizing the blockchain of the specified node
-                simulator.nodes[index].blockchain.visualize(index)
-            else:
-                print(
-                    f"Invalid index. Index should be an integer from 0 to {int(sys.argv[2]) - 1}"
-                )
-        else:
+# Settings that only a serial run supports
+SERIAL_ONLY = (
+    "trace",
+    "metrics",
+    "profile",
+    "folded",
+    "print_blockchain",
+    "export",
+    "render",
+    "checkpoint",
+    "resume",
+)
+
+
+def parse_args(argv=None):
+    """
+    Parse the command line into a config file path and the settings it overrides.
+
+    Every setting defaults to None, meaning not given, so that values from
+    the config file and DEFAULTS apply.
+    """
+    parser = argparse.ArgumentParser(description="Run a blockchain P2P network simulation")
+    parser.add_argument("--config", help="TOML or YAML file of settings, overridden by options")
+
+    network = parser.add_argument_group("network")
+    network.add_argument("--peers", type=int, help="Number of peers")
+    network.add_argument("--z0", type=float, help="Fraction of slow peers")
+    network.add_argument("--z1", type=float, help="Fraction of low CPU peers")
+    network.add_argument("--transaction-mean-gap", type=float, help="Mean time between transactions")
+    network.add_argument("--min-transactions-per-mining", type=int)
+    network.add_argument(
+        "--topology", choices=sorted(CHOICES["topology"]), help="Peer graph generator"
+    )
+    network.add_argument("--seed", type=int, help="Seed of all random numbers in the run")
+    network.add_argument(
+        "--inventory-interval", type=float, help="Time between batched transaction announcements"
+    )
+    network.add_argument(
+        "--columnar-transactions",
+        action="store_true",
+        default=None,
+        help="Store the transactions of mined blocks in shared columns",
+    )
+
+    run = parser.add_argument_group("run")
+    run.add_argument("--max-events", type=int, help="Event budget, 0 for no limit")
+    run.add_argument("--until-time", type=float, help="Stop after this simulation time")
+    run.add_argument("--queue-backend", choices=sorted(CHOICES["queue_backend"]))
+    run.add_argument(
+        "--workers", type=int, help="Split the run across this many processes when more than 1"
+    )
+    run.add_argument("--checkpoint", metavar="PATH", help="Checkpoint file written when the run stops")
+    run.add_argument("--checkpoint-every", type=int, help="Events between checkpoints")
+    run.add_argument("--resume", metavar="PATH", help="Continue the run saved in a checkpoint")
+
+    outputs = parser.add_argument_group("outputs")
+    outputs.add_argument("--trace", metavar="PATH", help="Binary trace of every event")
+    outputs.add_argument("--metrics", metavar="PATH", help="JSON file of the run's metrics")
+    outputs.add_argument(
+        "--profile",
+        action="store_true",
+        default=None,
+        help="Print the time spent on each kind of event",
+    )
+    outputs.add_argument("--folded", metavar="PATH", help="Folded stack samples of the run")
+    outputs.add_argument(
+        "--print-blockchain",
+        nargs="?",
+        const=FLAG_PATHS["print_blockchain"],
+        metavar="PATH",
+        help="Text dump of every node's blockchain (default blockchain.txt)",
+    )
+    outputs.add_argument("--export", metavar="PATH", help="Blockchain export, .gz or .zst to compress")
+    outputs.add_argument("--export-format", choices=sorted(CHOICES["export_format"]))
+    outputs.add_argument(
+        "--export-every", type=int, help="Events between incremental exports during the run"
+    )
+    outputs.add_argument(
+        "--render",
+        "--visualize-blockchain",
+        dest="render",
+        nargs="?",
+        const=FLAG_PATHS["render"],
+        metavar="DIRECTORY",
+        help="Render every node's block tree (default blockchains)",
+    )
+    outputs.add_argument("--render-format", help="Image format of rendered trees, such as png or svg")
+    outputs.add_argument("--render-nodes", type=int, nargs="+", help="IDs of the nodes to render")
+
+    args = vars(parser.parse_args(argv))
+    config_path = args.pop("config")
+    try:
+        config = load_config(config_path) if config_path is not None else {}
+        settings = resolve(config, args)
+    except (OSError, ValueError) as error:
+        parser.error(str(error))
+    if settings["workers"] is not None and settings["workers"] > 1:
+        unsupported = [
+            "--" + name.replace("_", "-")
+            for name in SERIAL_ONLY
+            if settings[name] not in (None, False)
+        ]
+        if unsupported:
+            parser.error(f"{', '.join(unsupported)} cannot be used with --workers")
+    return settings
+
+
+def run_parallel(settings):
+    """Run the simulation across worker processes and print its results."""
+    from parallel import ParallelSimulator
+
+    options = simulator_options(settings)
+    for name in ("trace_path", "metrics", "profile", "max_events"):
+        del options[name]
+    simulator = ParallelSimulator(workers=settings["workers"], **options)
+    results = simulator.simulate(
+        until_time=settings["until_time"], max_events=settings["max_events"] or None
+    )
+    del results["heights"]
+    print(json.dumps(results, indent=2))
+
+
+def run_serial(settings):
+    """Run the simulation in this process and write the requested outputs."""
+    if settings["resume"] is not None:
+        simulator = Simulator.load_checkpoint(settings["resume"], trace_path=settings["trace"])
+        if settings["trace"] is None and simulator.trace is not None:
             print(
-                f"Invalid index. Index should be an integer from 0 to {int(sys.argv[2]) - 1}"
+                f"Continuing trace `{simulator.trace.path}` from the checkpoint's "
+                f"{simulator.trace.recorded} events, pass --trace to record elsewhere"
             )
+    else:
+        simulator = Simulator(**simulator_options(settings))
+    max_events = settings["max_events"] or math.inf
+
+    sampler = None
+    if settings["folded"] is not None:
+        from profiling import StackSampler
+
+        sampler = StackSampler(settings["folded"])
+        sampler.start()
+    if settings["export"] is not None and settings["export_every"] is not None:
+        # Export incrementally, so the file grows while the run progresses
+        from export import BlockchainExporter
+
+        processed = 0
+        next_checkpoint = settings["checkpoint_every"] or math.inf
+        with BlockchainExporter(settings["export"], settings["export_format"]) as exporter:
+            for batch in simulator.simulate_iter(
+                settings["export_every"], settings["until_time"], max_events=max_events
+            ):
+                processed += len(batch)
+                exporter.export(simulator)
+                if settings["checkpoint"] is not None and processed >= next_checkpoint:
+                    simulator.save_checkpoint(settings["checkpoint"])
+                    next_checkpoint += settings["checkpoint_every"]
+            exporter.export(simulator)
+        if settings["checkpoint"] is not None:
+            simulator.save_checkpoint(settings["checkpoint"])
+    else:
+        processed = simulator.simulate(
+            until_time=settings["until_time"],
+            max_events=max_events,
+            checkpoint_path=settings["checkpoint"],
+            checkpoint_every=settings["checkpoint_every"] or math.inf,
+        )
+        if settings["export"] is not None:
+            simulator.export_blockchain(settings["export"], settings["export_format"])
+    if sampler is not None:
+        sampler.stop()
+
+    print(
+        f"Simulated {processed} events up to time {simulator.current_time:.2f} "
+        f"(stopped by {simulator.stop_reason}), longest chain {simulator.max_chain_length}"
+    )
+    if simulator.profiler is not None:
+        print(simulator.profiler.format())
+    if settings["metrics"] is not None:
+        if simulator.metrics is None:
+            print("Metrics not written: the resumed run was not collecting them")
+        else:
+            simulator.metrics.write(settings["metrics"])
+            print(f"Metrics written to file `{settings['metrics']}`")
+    if settings["export"] is not None:
+        print(f"Blockchain exported to file `{settings['export']}`")
+
+    # Printing the blockchain if requested
+    if settings["print_blockchain"] is not None:
+        simulator.print_blockchain(settings["print_blockchain"])
+        print(f"Blockchain written to file `{settings['print_blockchain']}`")
+
+    # Rendering the blockchains of the nodes if requested
+    if settings["render"] is not None:
+        paths = simulator.visualize(
+            settings["render"], settings["render_nodes"], settings["render_format"]
+        )
+        print(f"Blockchains of {len(paths)} nodes rendered to directory `{settings['render']}`")
+
+
+def main(argv=None):
+    settings = parse_args(argv)
+    if settings["workers"] is not None and settings["workers"] > 1:
+        run_parallel(settings)
+    else:
+        run_serial(settings)
+
+
+# Main function
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+import json
+import math
+
+
+class StreamingHistogram:
+    def __init__(self, relative_error=0.01):
+        """
+        Initialize a histogram of positive values with logarithmic buckets.
+
+        Adding a value is O(1), and quantiles are accurate to within
+        `relative_error` of the true value, as in DDSketch. Values <= 0 are
+        counted in a separate zero bucket.
+
+        Parameters:
+        - relative_error: Relative accuracy of the quantiles.
+        """
+        self.gamma = (1 + relative_error) / (1 - relative_error)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zeros = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        """Add a value to the histogram."""
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if value <= 0:
+            self.zeros += 1
+        else:
+            index = math.ceil(math.log(value) / self.log_gamma)
+            self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def quantile(self, q):
+        """Return an estimate of the q-th quantile, for q in [0, 1]."""
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                value = 2 * self.gamma**index / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def summary(self, quantiles=(0.5, 0.9, 0.99)):
+        """Return the count, mean, min, max and quantiles as a dict."""
+        if not self.count:
+            return {"count": 0}
+        summary = {
+            "count": self.count,
+            "mean": self.total / self.count,
+            "min": self.min,
+            "max": self.max,
+        }
+        for q in quantiles:
+            summary[f"p{round(q * 100)}"] = self.quantile(q)
+        return summary
+
+
+class MetricsCollector:
+    def __init__(self, simulator):
+        """
+        Initialize a collector of run metrics, updated in O(1) per event.
+
+        Parameters:
+        - simulator: Simulator whose nodes and block store are measured.
+        """
+        self.simulator = simulator
+        self.mined_at = {}  # Block serial -> time it was mined
+        self.miners = {}  # Block serial -> ID of the node that mined it
+        self.propagation_delay = StreamingHistogram()
+        self.mempool_size = StreamingHistogram()
+        self.fork_depths = {}  # Reorganization depth -> count
+
+    def on_block_mined(self, node, block, time):
+        """Record a block mined by a node."""
+        serial = self.simulator.block_store.serial(block)
+        self.mined_at[serial] = time
+        self.miners[serial] = node.id
+
+    def on_block_received(self, node, block, time):
+        """Record the first time a node stores a block mined by another node."""
+        mined_at = self.mined_at.get(self.simulator.block_store.serial(block))
+        if mined_at is not None:
+            self.propagation_delay.add(time - mined_at)
+
+    def on_reorg(self, depth):
+        """Record a node abandoning `depth` blocks of its longest chain."""
+        self.fork_depths[depth] = self.fork_depths.get(depth, 0) + 1
+
+    def on_mempool(self, size):
+        """Record the size of a node's transaction pool."""
+        self.mempool_size.add(size)
+
+    def summary(self):
+        """Return the metrics of the run so far as a dict."""
+        simulator = self.simulator
+        nodes = simulator.nodes
+        best = max(nodes, key=lambda node: node.blockchain.get_height())
+        chain = best.blockchain.get_longest_chain()
+        store = simulator.block_store
+
+        # Who mined the blocks of the longest chain, genesis excluded
+        blocks_per_node = [0] * len(nodes)
+        for block in chain[1:]:
+            miner = self.miners.get(store.serial(block))
+            if miner is not None:
+                blocks_per_node[miner] += 1
+        chain_blocks = sum(blocks_per_node)
+
+        def share(predicate):
+            mined = sum(
+                count for node, count in zip(nodes, blocks_per_node) if predicate(node)
+            )
+            return {
+                "chain_share": mined / chain_blocks if chain_blocks else None,
+                "node_share": sum(1 for node in nodes if predicate(node)) / len(nodes),
+            }
+
+        blocks_mined = len(self.mined_at)
+        stale_blocks = blocks_mined - chain_blocks
+        return {
+            "events": simulator.events_processed,
+            "sim_time": simulator.current_time,
+            "blocks_mined": blocks_mined,
+            "longest_chain_length": len(chain),
+            "stale_blocks": stale_blocks,
+            "stale_ratio": stale_blocks / blocks_mined if blocks_mined else None,
+            "propagation_delay": self.propagation_delay.summary(),
+            "fork_depths": dict(sorted(self.fork_depths.items())),
+            "mempool_size": self.mempool_size.summary(),
+            "fast_nodes": share(lambda node: node.speed == 1),
+            "slow_nodes": share(lambda node: node.speed != 1),
+            "high_cpu_nodes": share(lambda node: node.CPU_speed == 1),
+            "low_cpu_nodes": share(lambda node: node.CPU_speed != 1),
+            "longest_chain_blocks_per_node": blocks_per_node,
+        }
+
+    def write(self, path):
+        """Write the summary to a JSON file."""
+        with open(path, "w") as file:
+            json.dump(self.summary(), file, indent=2)
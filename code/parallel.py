@@ -0,0 +1,494 @@
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from blockchain import Block
+from peer import Peer
+from simulator import Simulator
+from topology import partition
+
+
+# Peer handlers receiving messages from other nodes, called with
+# (item, time, sender) arguments
+PEER_MESSAGES = {
+    "receive_inventory",
+    "receive_getdata",
+    "receive_transactions",
+}
+
+
+class PartitionQueue:
+    def __init__(self, queue, owner, rank):
+        """
+        Initialize the event queue of one partition of a parallel simulation.
+
+        Events of the partition's own nodes go to `queue`. Block deliveries
+        and PEER_MESSAGES to nodes of other partitions are collected in
+        `outbox` as (handler name, time, target, sender, item) messages
+        instead. Every message already includes the link latency, so it
+        arrives at least a lookahead after it was sent.
+
+        Parameters:
+        - queue: Event queue of the partition's own events.
+        - owner: List of the partition of every node.
+        - rank: Index of this partition.
+        """
+        self.queue = queue
+        self.owner = owner
+        self.rank = rank
+        self.outbox = []
+
+    def schedule(self, time, handler, args=()):
+        name = handler.__name__
+        if name == "deliver_block":
+            peer, block, _, sender = args
+            target = peer.node.id
+            if self.owner[target] != self.rank:
+                self.outbox.append(("deliver_block", time, target, sender, block))
+                return
+        elif name in PEER_MESSAGES:
+            target = handler.__self__.node.id
+            if self.owner[target] != self.rank:
+                item, _, sender = args
+                self.outbox.append((name, time, target, sender, item))
+                return
+        self.queue.schedule(time, handler, args)
+
+    def pop_entry(self):
+        return self.queue.pop_entry()
+
+    def peek_entry(self):
+        return self.queue.peek_entry()
+
+    def is_empty(self):
+        return self.queue.is_empty()
+
+    def __len__(self):
+        return len(self.queue)
+
+
+class RemoteNode:
+    __slots__ = ("id",)
+
+    def __init__(self, id):
+        """
+        Initialize a stand-in for a node of another partition.
+
+        Only the ID is known, which is all PartitionQueue needs to route the
+        messages sent to the node.
+
+        Parameters:
+        - id: ID of the node.
+        """
+        self.id = id
+
+
+class PartitionSimulator(Simulator):
+    def __init__(self, rank, parts, **config):
+        """
+        Initialize the part of a network that one partition simulates.
+
+        The topology, speeds and latencies are drawn for the whole network
+        from the seed, exactly as by a Simulator, so every partition agrees
+        on them. Only the partition's own nodes are built, though, each with
+        the random stream it has in a serial run. A node of another partition
+        linked to an own node gets a RemoteNode and a bare Peer, so that
+        messages can be addressed to it; every other entry of `nodes` and
+        `peers` is None. Only the latencies of links leaving own nodes are
+        kept, and only own nodes start generating transactions.
+
+        Parameters:
+        - rank: Index of this partition.
+        - parts: Number of partitions.
+        - config: Keyword arguments of the Simulator.
+        """
+        self.rank = rank
+        self.parts = parts
+        super().__init__(**config)
+        # Partitions number their transactions rank, rank + parts, ... so
+        # that no two partitions create the same ID
+        self.next_transaction_id = rank
+        self.transaction_id_stride = parts
+
+    def create_nodes(self, speeds, CPU_speeds):
+        """Create the own nodes and stand-ins for the remote nodes linked to them."""
+        graph = self.graph
+        # The partition is needed from here on, and depends on the graph only
+        self.owner = partition(graph, self.parts)
+        self.local = np.flatnonzero(self.owner == self.rank).tolist()
+        self.nodes = [None] * graph.n
+        self.peers = [None] * graph.n
+        for i in self.local:
+            self.nodes[i], self.peers[i] = self.create_node(i, speeds[i], CPU_speeds[i])
+        for i in self.local:
+            for j in graph.neighbors(i).tolist():
+                if self.peers[j] is None:
+                    self.nodes[j] = RemoteNode(j)
+                    self.peers[j] = Peer(self.nodes[j], graph.n, self)
+
+    def connect_peers(self):
+        """Connect every own node to all of its neighbours, in increasing ID order."""
+        for i in self.local:
+            for j in self.graph.neighbors(i).tolist():
+                self.peers[i].connect_to_peer(self.peers[j])
+                self.nodes[i].add_peer(self.peers[j])
+
+    def generate_latencies(self, speeds):
+        """Draw the latencies of every link, then keep those leaving own nodes."""
+        super().generate_latencies(speeds)
+        graph = self.graph
+        own = self.owner == self.rank
+        own_links = own[graph.edge_sources()]
+        self.latencies = self.latencies[own_links]
+        self.link_rates = self.link_rates[own_links]
+        self.link_targets = graph.indices[own_links]
+        # Shift from the position of a link of an own node in graph.indices
+        # to its position in the kept arrays
+        degrees = np.where(own, graph.degrees(), 0)
+        self.link_offsets = np.cumsum(degrees) - degrees - graph.indptr[:-1]
+
+    def get_latency(self, i, j, messg_size=1):
+        """Calculate the latency from own node i to its neighbour j."""
+        link = self.graph.edge_index(i, j)
+        if link is None:
+            raise ValueError(f"Nodes {i} and {j} are not connected")
+        link += self.link_offsets[i]
+        return float(self.latencies[link] + messg_size / self.link_rates[link])
+
+    def get_latencies(self, i, messg_size=1):
+        """Calculate the latencies from own node i to each of its peers, in peer order."""
+        start = self.graph.indptr[i] + self.link_offsets[i]
+        end = start + self.graph.degree(i)
+        return self.latencies[start:end] + messg_size / self.link_rates[start:end]
+
+    def generate_transactions_init(self):
+        """Generate initial transactions for the own peers."""
+        for i in self.local:
+            self.priority_queue.schedule(0, self.peers[i].generate_transactions, (0,))
+
+
+class Partition:
+    def __init__(self, rank, parts, config):
+        """
+        Initialize one partition of a parallel simulation.
+
+        Every partition draws the same network from the same seed, then only
+        builds and runs the nodes it owns, see PartitionSimulator. Blocks are identified across
+        partitions by a (rank, serial) key given by the partition that mined
+        them, so a block reaching a partition twice is the same Block object.
+        A block is sent along with the ancestors the receiving partition has
+        not been sent yet, parents first, so imported blocks are registered
+        in the block store on arrival with their real parent.
+
+        Parameters:
+        - rank: Index of this partition.
+        - parts: Number of partitions.
+        - config: Keyword arguments of the Simulator.
+        """
+        self.rank = rank
+        self.simulator = simulator = PartitionSimulator(rank, parts, **config)
+        self.owner = simulator.owner
+        self.local = simulator.local
+        self.queue = PartitionQueue(simulator.priority_queue, self.owner.tolist(), rank)
+        simulator.priority_queue = self.queue
+        self.imported = {}  # Key -> serial of a block from another partition
+        self.keys = {}  # Serial -> key of the blocks in `imported`
+        self.sent = [set() for _ in range(parts)]  # Keys of blocks already sent
+
+    def lookahead(self):
+        """Return the smallest latency of the links leaving the partition."""
+        simulator = self.simulator
+        leaving = self.owner[simulator.link_targets] != self.rank
+        if not leaving.any():
+            return math.inf
+        return float(simulator.latencies[leaving].min())
+
+    def next_time(self):
+        """Return the time of the partition's next event, inf if there is none."""
+        return self.queue.peek_entry()[0] if len(self.queue) else math.inf
+
+    def block_key(self, serial):
+        """Return the key identifying a registered block across partitions."""
+        return self.keys.get(serial, (self.rank, serial))
+
+    def pack_block(self, block, rank, blocks):
+        """
+        Add a block and its ancestors not yet sent to a partition to `blocks`.
+
+        Ancestors are added before their children, and blocks that came
+        from the partition itself are never sent back to it.
+
+        Parameters:
+        - block: Block delivered to a node of the partition.
+        - rank: Index of the receiving partition.
+        - blocks: Dict of the blocks sent in a message, key -> block data.
+
+        Returns the key of the block.
+        """
+        store = self.simulator.block_store
+        sent = self.sent[rank]
+        serial = store.serial(block)
+        missing = []
+        # The genesis block, serial 0, is in every store
+        while serial > 0:
+            key = self.block_key(serial)
+            if key[0] == rank or key in sent:
+                break
+            sent.add(key)
+            missing.append((key, store.blocks[serial]))
+            serial = store.parents[serial]
+        for key, ancestor in reversed(missing):
+            blocks[key] = (
+                ancestor.block_id,
+                ancestor.previous_block_id,
+                ancestor.transactions,
+            )
+        return self.block_key(store.serial(block))
+
+    def receive(self, message):
+        """Schedule the deliveries of a message from another partition."""
+        blocks, events = message
+        simulator = self.simulator
+        store = simulator.block_store
+        for key, (block_id, previous_block_id, transactions) in blocks.items():
+            if key[0] != self.rank and key not in self.imported:
+                block = Block(
+                    block_id,
+                    previous_block_id,
+                    transactions,
+                    simulator.transaction_store,
+                )
+                # Parents are sent first, so the parent is already registered
+                serial = store.register(block)
+                self.imported[key] = serial
+                self.keys[serial] = key
+        schedule = self.queue.queue.schedule
+        for name, event_time, target, sender, item in events:
+            peer = simulator.peers[target]
+            if name == "deliver_block":
+                serial = item[1] if item[0] == self.rank else self.imported[item]
+                schedule(
+                    event_time,
+                    simulator.deliver_block,
+                    (peer, store.blocks[serial], event_time, sender),
+                )
+                continue
+            if name == "receive_transactions":
+                # Let the receiving node answer requests for them
+                for transaction in item:
+                    simulator.transactions.setdefault(transaction.txn_id, transaction)
+            schedule(event_time, getattr(peer, name), (item, event_time, sender))
+
+    def send(self):
+        """Return the outgoing messages of the last window, keyed by partition."""
+        messages = {}
+        for name, event_time, target, sender, item in self.queue.outbox:
+            rank = int(self.owner[target])
+            blocks, events = messages.setdefault(rank, ({}, []))
+            if name == "deliver_block":
+                item = self.pack_block(item, rank, blocks)
+            events.append((name, event_time, target, sender, item))
+        self.queue.outbox = []
+        return messages
+
+    def run(self, bound, inbox, max_events):
+        """
+        Run the partition's events up to a time bound.
+
+        Parameters:
+        - bound: Time of the last event that may be run.
+        - inbox: Messages from other partitions.
+        - max_events: Maximum number of events to run.
+
+        Returns the outgoing messages, the time of the next event and the
+        number of events run.
+        """
+        for message in inbox:
+            self.receive(message)
+        processed = self.simulator.simulate(until_time=bound, max_events=max_events)
+        return self.send(), self.next_time(), processed
+
+    def summary(self):
+        """Return the results of the partition's nodes."""
+        simulator = self.simulator
+        return {
+            "events": simulator.events_processed,
+            "sim_time": simulator.current_time,
+            "max_fork_depth": simulator.max_fork_depth,
+            "heights": {
+                i: simulator.nodes[i].blockchain.get_height() for i in self.local
+            },
+        }
+
+
+def serve(rank, parts, config, connection):
+    """Run a partition in a worker process, driven by ParallelSimulator."""
+    part = Partition(rank, parts, config)
+    connection.send((part.lookahead(), part.next_time()))
+    while True:
+        command, *payload = connection.recv()
+        if command == "run":
+            connection.send(part.run(*payload))
+        else:
+            connection.send(part.summary())
+            break
+    connection.close()
+
+
+class ParallelSimulator:
+    def __init__(self, n, z0, z1, workers=None, seed=None, **options):
+        """
+        Initialize a simulation split across worker processes.
+
+        The peer graph is partitioned, and each worker process runs the
+        events of one partition. Synchronization is conservative: a block or
+        transaction sent to another partition arrives at least `lookahead`
+        later, the smallest latency of a link between partitions, so all
+        partitions can safely run the window [t, t + lookahead), where t is
+        the earliest pending event, before exchanging messages.
+
+        The messages of a window are batched per partition, pickled and
+        relayed through the coordinator over multiprocessing Pipes, not
+        shared-memory queues: blocks and transactions are Python objects
+        that would have to be serialized for shared memory too, and one
+        batch per window keeps that to a few transfers per window.
+
+        Parameters:
+        - n: Number of nodes in the network.
+        - z0: Parameter for generating speeds.
+        - z1: Parameter for generating CPU speeds.
+        - workers: Number of worker processes, defaults to the CPU count.
+        - seed: Seed of all random numbers in the run, None for a fresh one.
+        - options: Other keyword arguments of the Simulator.
+        """
+        if seed is None:
+            seed = np.random.SeedSequence().entropy
+        self.workers = workers or os.cpu_count()
+        self.config = dict(options, n=n, z0=z0, z1=z1, seed=seed, max_events=None)
+        self.stop_reason = None
+
+    def simulate(self, until_time=None, max_events=None):
+        """
+        Run the simulation in worker processes and return its results.
+
+        Parameters:
+        - until_time: Stop before the first event scheduled after this time.
+        - max_events: Stop once this many events have been processed in
+          total. Checked between windows, so a run may exceed it.
+
+        Returns a dict with the number of events, windows, the longest
+        chain, the deepest fork and the height of every node's chain.
+        """
+        start_time = time.perf_counter()
+        connections, processes = [], []
+        for rank in range(self.workers):
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=serve, args=(rank, self.workers, self.config, child)
+            )
+            process.start()
+            connections.append(parent)
+            processes.append(process)
+        try:
+            hellos = [connection.recv() for connection in connections]
+            lookahead = min(hello[0] for hello in hellos)
+            next_times = [hello[1] for hello in hellos]
+            inboxes = [[] for _ in connections]
+            message_time = math.inf
+            processed = windows = 0
+            while True:
+                start = min(min(next_times), message_time)
+                if start == math.inf:
+                    self.stop_reason = "empty"
+                    break
+                if until_time is not None and start > until_time:
+                    self.stop_reason = "until_time"
+                    break
+                if max_events is not None and processed >= max_events:
+                    self.stop_reason = "max_events"
+                    break
+                bound = math.nextafter(start + lookahead, -math.inf)
+                if until_time is not None:
+                    bound = min(bound, until_time)
+                budget = None if max_events is None else max_events - processed
+                for connection, inbox in zip(connections, inboxes):
+                    connection.send(("run", bound, inbox, budget))
+                inboxes = [[] for _ in connections]
+                message_time = math.inf
+                for rank, connection in enumerate(connections):
+                    messages, next_times[rank], done = connection.recv()
+                    processed += done
+                    for target, message in messages.items():
+                        inboxes[target].append(message)
+                        message_time = min(
+                            message_time, min(event[1] for event in message[1])
+                        )
+                windows += 1
+            for connection in connections:
+                connection.send(("stop",))
+            summaries = [connection.recv() for connection in connections]
+        finally:
+            for process in processes:
+                process.join(timeout=10)
+                if process.is_alive():
+                    process.terminate()
+
+        heights = {}
+        for summary in summaries:
+            heights.update(summary["heights"])
+        return {
+            "workers": self.workers,
+            "lookahead": lookahead,
+            "windows": windows,
+            "events": sum(summary["events"] for summary in summaries),
+            "sim_time": max(summary["sim_time"] for summary in summaries),
+            "wall_time": time.perf_counter() - start_time,
+            "stop_reason": self.stop_reason,
+            "max_chain_length": max(heights.values()),
+            "max_fork_depth": max(summary["max_fork_depth"] for summary in summaries),
+            "heights": [heights[i] for i in range(len(heights))],
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run a simulation split across worker processes"
+    )
+    parser.add_argument("--peers", type=int, required=True)
+    parser.add_argument("--z0", type=float, required=True)
+    parser.add_argument("--z1", type=float, required=True)
+    parser.add_argument("--transaction-mean-gap", type=float, required=True)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--min-transactions-per-mining", type=int, default=10)
+    parser.add_argument("--max-events", type=int, default=None)
+    parser.add_argument("--until-time", type=float, default=None)
+    parser.add_argument("--topology", default="random")
+    parser.add_argument("--queue-backend", default="heap")
+    args = parser.parse_args()
+    if args.max_events is None and args.until_time is None:
+        parser.error("one of --max-events and --until-time is required")
+
+    simulator = ParallelSimulator(
+        args.peers,
+        args.z0,
+        args.z1,
+        workers=args.workers,
+        seed=args.seed,
+        min_transactions_per_mining=args.min_transactions_per_mining,
+        transaction_mean_gap=args.transaction_mean_gap,
+        topology=args.topology,
+        queue_backend=args.queue_backend,
+    )
+    results = simulator.simulate(until_time=args.until_time, max_events=args.max_events)
+    del results["heights"]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
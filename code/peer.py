@@ -1,12 +1,23 @@
-from blockchain import Blockchain
-import numpy as np, random
+import numpy as np
+
+from blockchain import Blockchain, BlockTemplate
 from transaction import Transaction
-from event import Event
+from rng import RandomStream
+
+# Size of one transaction ID in an inventory or request message, relative to
+# the size of a transaction
+INVENTORY_ENTRY_SIZE = 1 / 32
 
 
 class Node:
     def __init__(
-        self, id, speed, CPU_speed, min_transactions_per_mining, simulator=None
+        self,
+        id,
+        speed,
+        CPU_speed,
+        min_transactions_per_mining,
+        simulator=None,
+        rng=None,
     ):
         """
         Initialize a Node object.
@@ -17,33 +28,54 @@ class Node:
         - CPU_speed: CPU speed of the node.
         - min_transactions_per_mining: Minimum number of transactions required to mine a block.
         - simulator: Reference to the simulator object.
+        - rng: RandomStream of the node, used for its transactions and mining delays.
         """
         self.id = id
         self.speed = speed
         self.CPU_speed = CPU_speed
-        self.blockchain = Blockchain()
-        self.transaction_pool = []
+        if simulator is not None:
+            self.blockchain = Blockchain(
+                simulator.transaction_store, simulator.block_store
+            )
+        else:
+            self.blockchain = Blockchain()
+        # Pending transactions and the Merkle root of the next block
+        self.template = BlockTemplate()
+        # IDs of the transactions the node has received or requested
+        self.seen_transactions = set()
         self.peers = []
         self.min_transactions_per_mining = min_transactions_per_mining
         self.simulator = simulator
         self.blocks_received = 0
         self.time_for_avg = 0
         self.avg_time = 0
+        self.rng = rng if rng is not None else RandomStream()
+        # Number of times the node started mining on a new tip, see schedule_mining
+        self.mining_generation = 0
+
+    @property
+    def transaction_pool(self):
+        """Pending transactions keyed by ID, in arrival order."""
+        return self.template.transactions
 
     def __eq__(self, other):
         """Check equality between nodes based on their IDs."""
         return self.id == other.id
 
+    def __getstate__(self):
+        # Peers are saved by node ID and relinked by the Simulator, so that
+        # pickling does not recurse through the whole peer graph
+        state = self.__dict__.copy()
+        state["peers"] = [peer.node.id for peer in self.peers]
+        return state
+
     def add_peer(self, peer):
         """Add a peer to the list of connected peers."""
         self.peers.append(peer)
 
     def check_if_exists_in_blockchain(self, block):
         """Check if a block exists in the node's blockchain."""
-        for b in self.blockchain.blocks:
-            if b == block:
-                return True
-        return False
+        return self.blockchain.contains(block)
 
     def receive_block(self, block, time):
         """
@@ -58,14 +90,12 @@ class Node:
         self.avg_time = self.time_for_avg / self.blocks_received
         if self.validate_block(block) and not self.check_if_exists_in_blockchain(block):
             for transaction in block.transactions:
-                (
-                    self.transaction_pool.remove(transaction)
-                    if transaction in self.transaction_pool
-                    else None
-                )
+                self.template.discard(transaction.txn_id)
             self.blockchain.add_block(block)
-            self.simulator.priority_queue.push(
-                Event(self, "propagate_block", {"block": block, "time": time}, time)
+            if self.simulator.metrics is not None:
+                self.simulator.metrics.on_block_received(self, block, time)
+            self.simulator.priority_queue.schedule(
+                time, self.propagate_block, (block, time)
             )
 
     def receive_transaction(self, transaction, time):
@@ -76,59 +106,82 @@ class Node:
         - transaction: Transaction received from the peer.
         - time: Time at which the transaction is received.
         """
-        found = False
-        for block in self.blockchain.blocks:
-            if transaction in block.transactions:
-                found = True
-                break
-        if not found:
-            self.transaction_pool.append(transaction)
+        if not self.blockchain.contains_transaction(transaction.txn_id):
+            self.template.add(transaction)
+        if self.simulator.metrics is not None:
+            self.simulator.metrics.on_mempool(len(self.template))
 
         # Automatically mine a block when the transaction pool reaches a size of 2
         time += 1
-        if len(self.transaction_pool) >= self.min_transactions_per_mining:
+        if len(self.template) >= self.min_transactions_per_mining:
             self.mine_block(time)
 
     def mine_block(self, time):
         """
         Mine a block with transactions from the transaction pool.
 
+        The new block moves the node's tip, so the pending mining race,
+        drawn for the old tip, is abandoned.
+
         Parameters:
         - time: Time at which the block is mined.
         """
-        self.transaction_pool.append(
-            Transaction(-1, self.id, 50, timestamp=time)
+        self.mining_generation += 1
+        transactions = list(self.template.transactions.values())
+        transactions.append(
+            Transaction(
+                -1, self.id, 50, timestamp=time, txn_id=self.simulator.new_transaction_id()
+            )
         )  # Add a reward transaction
-        new_block = self.blockchain.create_block(self.transaction_pool, self.id)
-        self.simulator.longest_chains[self.simulator.nodes.index(self)] = (
-            self.blockchain.get_longest_chain()
+        new_block = self.blockchain.create_block(
+            transactions, self.id, self.template.merkle_root()
         )
-        self.simulator.priority_queue.push(
-            Event(
-                self,
-                "propagate_block",
-                {
-                    "block": new_block,
-                    "time": time,
-                },
-                time,
-            )
+        if self.simulator.metrics is not None:
+            self.simulator.metrics.on_block_mined(self, new_block, time)
+        self.simulator.update_chain_length(self)
+        self.simulator.priority_queue.schedule(
+            time, self.propagate_block, (new_block, time)
         )
-        self.transaction_pool = []  # Clear the transaction pool
+        self.template.clear()  # Clear the transaction pool
         return new_block
 
-    def conditional_mine_block(self, prev_longest_chain, time):
+    def mining_delay(self):
+        """Return a random time for the node to find a block on its tip."""
+        h = self.simulator.h
+        return self.rng.exponential(self.avg_time / 10 * h if self.CPU_speed == 1 else h)
+
+    def schedule_mining(self, time):
         """
-        Mine a block conditionally based on the longest chain.
+        Start mining on the node's new tip, abandoning the previous race.
+
+        The time to find a block is drawn afresh for every tip, since
+        mining_delay() depends on the node's average block arrival time,
+        which changes with every received block. Each restart, like every
+        block the node mines itself, increments `mining_generation`, and only
+        the finish_mining event of the current generation mines; older events are invalidated lazily and dropped in
+        O(1) when they fire, so at most one event per node is live.
 
         Parameters:
-        - prev_longest_chain: Previous longest chain.
-        - time: Time at which the block is mined.
+        - time: Time at which the tip changed.
         """
-        if self.simulator.is_proper_prefix(
-            prev_longest_chain, self.blockchain.get_longest_chain()
-        ):
-            self.mine_block(time)
+        self.mining_generation += 1
+        found_time = time + self.mining_delay()
+        self.simulator.priority_queue.schedule(
+            found_time, self.finish_mining, (found_time, self.mining_generation)
+        )
+
+    def finish_mining(self, time, generation):
+        """
+        Mine a block on the current tip when the node's mining event fires.
+
+        Parameters:
+        - time: Time at which the block is found.
+        - generation: Value of `mining_generation` when the event was
+          scheduled; the event is ignored if the node restarted since.
+        """
+        if generation != self.mining_generation:
+            return
+        self.mine_block(time)
 
     def propagate_block(self, block, time):
         """
@@ -138,46 +191,23 @@ class Node:
         - block: Block to be propagated.
         - time: Time at which the block is propagated.
         """
-        for peer in self.peers:
-            self.simulator.priority_queue.push(
-                Event(
-                    peer,
-                    "receive_block",
-                    {
-                        "block": block,
-                        "time": time
-                        + self.simulator.get_latency(
-                            self.id, peer.node.id, messg_size=len(block.transactions)
-                        ),
-                    },
-                    time
-                    + self.simulator.get_latency(
-                        self.id, peer.node.id, messg_size=len(block.transactions)
-                    ),
-                )
-            )
+        schedule = self.simulator.priority_queue.schedule
+        deliver_block = self.simulator.deliver_block
+        arrivals = time + self.simulator.get_latencies(
+            self.id, messg_size=block.num_transactions
+        )
+        for peer, arrival in zip(self.peers, arrivals.tolist()):
+            schedule(arrival, deliver_block, (peer, block, arrival, self.id))
 
     def validate_block(self, block):
         """Validate a received block before adding it to the blockchain."""
-        # Check if sender has sufficient balance
-        for transaction in block.transactions:
-            if transaction.sender != -1:
-                sender_balance = self.get_balance(transaction.sender)
-                if sender_balance < transaction.amount:
-                    return False
-        # For simplicity, assume all blocks are valid in this implementation
-        return True
+        # Check if senders have sufficient balance on the block's parent chain,
+        # which the block store computes once for all nodes
+        return self.blockchain.is_valid(block)
 
     def get_balance(self, account_id):
-        """Get the balance of an account from the blockchain."""
-        balance = 1200000
-        for b in self.blockchain.blocks:
-            for txn in b.transactions:
-                if txn.sender == account_id:
-                    balance -= txn.amount
-                if txn.receiver == account_id:
-                    balance += txn.amount
-        return balance
+        """Get the balance of an account on the longest chain."""
+        return self.blockchain.get_tip_state().get(account_id)
 
 
 class Peer:
@@ -195,11 +225,20 @@ class Peer:
         self.rel_transaction_timestamp = 0
         self.n = n
         self.simulator = simulator
+        # (transaction ID, source node ID) pairs waiting for send_inventory
+        self.inventory = []
+        self.inventory_scheduled = False
 
     def __eq__(self, other) -> bool:
         """Check equality between peers based on their associated nodes."""
         return self.node.id == other.node.id
 
+    def __getstate__(self):
+        # Connections are saved by node ID, like Node.peers
+        state = self.__dict__.copy()
+        state["connections"] = [peer.node.id for peer in self.connections]
+        return state
+
     def connect_to_peer(self, peer):
         """Establish a connection to another peer."""
         self.connections.append(peer)
@@ -211,31 +250,29 @@ class Peer:
         Parameters:
         - time: Time at which the transaction is generated.
         """
+        rng = self.node.rng
         sender = self.node.id
-        nodes = [i for i in range(self.n) if i != sender]
-        receiver = random.choice(nodes)
-        amount = random.randint(1, 50)
+        # Pick a receiver among the other nodes without building their list
+        receiver = rng.integers(0, self.n - 1)
+        if receiver >= sender:
+            receiver += 1
+        amount = rng.integers(1, 51)
         transaction = Transaction(
-            sender, receiver, amount, self.rel_transaction_timestamp
+            sender,
+            receiver,
+            amount,
+            self.rel_transaction_timestamp,
+            self.simulator.new_transaction_id(),
         )
-        self.rel_transaction_timestamp += np.random.exponential(
+        self.rel_transaction_timestamp += rng.exponential(
             self.simulator.transaction_mean_gap
         )
-        self.simulator.priority_queue.push(
-            Event(
-                self,
-                "generate_transactions",
-                {"time": self.rel_transaction_timestamp},
-                self.rel_transaction_timestamp,
-            )
+        next_time = self.rel_transaction_timestamp
+        self.simulator.priority_queue.schedule(
+            next_time, self.generate_transactions, (next_time,)
         )
-        self.simulator.priority_queue.push(
-            Event(
-                self,
-                "broadcast_transaction",
-                {"transaction": transaction, "time": self.rel_transaction_timestamp},
-                self.rel_transaction_timestamp,
-            )
+        self.simulator.priority_queue.schedule(
+            next_time, self.broadcast_transaction, (transaction, next_time)
         )
 
     def receive_block(self, block, time):
@@ -248,15 +285,127 @@ class Peer:
         """
         self.node.receive_block(block, time)
 
-    def receive_transaction(self, transaction, time):
+    def receive_transaction(self, transaction, time, sender=None):
         """
-        Receive a transaction from a peer.
+        Receive a transaction from a peer and announce it to the other peers.
 
         Parameters:
         - transaction: Transaction received from the peer.
         - time: Time at which the transaction is received.
+        - sender: ID of the node that sent the transaction.
         """
+        self.node.seen_transactions.add(transaction.txn_id)
         self.node.receive_transaction(transaction, time)
+        self.announce(transaction, time, sender)
+
+    def receive_transactions(self, transactions, time, sender):
+        """
+        Receive the transactions requested from a peer.
+
+        Parameters:
+        - transactions: Transactions sent by the peer.
+        - time: Time at which the transactions are received.
+        - sender: ID of the node that sent the transactions.
+        """
+        for transaction in transactions:
+            self.receive_transaction(transaction, time, sender)
+
+    def announce(self, transaction, time, source=None):
+        """
+        Queue a transaction for the next inventory message to the peers.
+
+        Inventory messages are sent every `inventory_interval`, so one
+        message announces every transaction queued since the last one.
+
+        Parameters:
+        - transaction: Transaction to announce.
+        - time: Time at which the transaction was received.
+        - source: ID of the node the transaction came from, which is not
+          sent an announcement, None if the node created it.
+        """
+        self.inventory.append((transaction.txn_id, source))
+        if not self.inventory_scheduled:
+            self.inventory_scheduled = True
+            send_time = time + self.simulator.inventory_interval
+            self.simulator.priority_queue.schedule(
+                send_time, self.send_inventory, (send_time,)
+            )
+
+    def send_inventory(self, time):
+        """
+        Announce the queued transactions to every peer that has not sent them.
+
+        Parameters:
+        - time: Time at which the inventory is sent.
+        """
+        inventory, self.inventory = self.inventory, []
+        self.inventory_scheduled = False
+        sources = {}
+        for txn_id, source in inventory:
+            sources[source] = sources.get(source, 0) + 1
+        all_ids = [txn_id for txn_id, _ in inventory]
+        sizes = np.array(
+            [len(inventory) - sources.get(peer.node.id, 0) for peer in self.connections]
+        )
+        arrivals = time + self.simulator.get_latencies(
+            self.node.id, messg_size=sizes * INVENTORY_ENTRY_SIZE
+        )
+        schedule = self.simulator.priority_queue.schedule
+        for peer, size, arrival in zip(
+            self.connections, sizes.tolist(), arrivals.tolist()
+        ):
+            if not size:
+                continue
+            if size == len(inventory):
+                txn_ids = all_ids
+            else:
+                txn_ids = [
+                    txn_id for txn_id, source in inventory if source != peer.node.id
+                ]
+            schedule(arrival, peer.receive_inventory, (txn_ids, arrival, self.node.id))
+
+    def receive_inventory(self, txn_ids, time, sender):
+        """
+        Request the announced transactions the node has not seen yet.
+
+        Parameters:
+        - txn_ids: IDs of the transactions announced by the peer.
+        - time: Time at which the inventory is received.
+        - sender: ID of the node that sent the inventory.
+        """
+        seen = self.node.seen_transactions
+        wanted = [txn_id for txn_id in txn_ids if txn_id not in seen]
+        if not wanted:
+            return
+        # Transactions are requested once, from the first peer announcing them
+        seen.update(wanted)
+        arrival = time + self.simulator.get_latency(
+            self.node.id, sender, messg_size=len(wanted) * INVENTORY_ENTRY_SIZE
+        )
+        self.simulator.priority_queue.schedule(
+            arrival,
+            self.simulator.peers[sender].receive_getdata,
+            (wanted, arrival, self.node.id),
+        )
+
+    def receive_getdata(self, txn_ids, time, requester):
+        """
+        Send the transactions requested by a peer.
+
+        Parameters:
+        - txn_ids: IDs of the requested transactions.
+        - time: Time at which the request is received.
+        - requester: ID of the node that requested the transactions.
+        """
+        transactions = [self.simulator.transactions[txn_id] for txn_id in txn_ids]
+        arrival = time + self.simulator.get_latency(
+            self.node.id, requester, messg_size=len(transactions)
+        )
+        self.simulator.priority_queue.schedule(
+            arrival,
+            self.simulator.peers[requester].receive_transactions,
+            (transactions, arrival, self.node.id),
+        )
 
     def mine_block(self):
         """Mine a new block using the associated node's mining function."""
@@ -271,24 +420,18 @@ class Peer:
         - time: Time at which the block is propagated.
         """
         for peer in self.connections:
-            self.simulator.priority_queue.push(
-                Event(peer, "receive_block", {"block": block, "time": time}, time)
+            self.simulator.priority_queue.schedule(
+                time, self.simulator.deliver_block, (peer, block, time, self.node.id)
             )
 
     def broadcast_transaction(self, transaction, time):
         """
-        Broadcast a transaction to other peers.
+        Announce a transaction created by the node to its peers.
 
         Parameters:
         - transaction: Transaction to be broadcasted.
         - time: Time at which the transaction is broadcasted.
         """
-        for peer in self.connections:
-            self.simulator.priority_queue.push(
-                Event(
-                    peer,
-                    "receive_transaction",
-                    {"transaction": transaction, "time": time},
-                    time,
-                )
-            )
+        self.simulator.transactions[transaction.txn_id] = transaction
+        self.node.seen_transactions.add(transaction.txn_id)
+        self.announce(transaction, time)
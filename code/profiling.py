@@ -0,0 +1,154 @@
+import signal
+import sys
+import threading
+from collections import Counter
+
+from metrics import StreamingHistogram
+
+
+class EventProfiler:
+    def __init__(self, sample_every=1000):
+        """
+        Initialize a profiler of the time spent handling each kind of event.
+
+        Events are grouped by the name of their handler. For each kind the
+        profiler keeps the count, the total wall time and a histogram of the
+        wall times, and every `sample_every` events it samples the size of
+        the event queue.
+
+        Parameters:
+        - sample_every: Number of events between queue size samples.
+        """
+        self.sample_every = sample_every
+        self.counts = {}
+        self.totals = {}  # Event kind -> total wall time in ns
+        self.histograms = {}  # Event kind -> StreamingHistogram of ns
+        self.queue_sizes = []  # (events, simulation time, queue size) samples
+        self.events = 0
+
+    def record(self, entry, elapsed, queue):
+        """
+        Record a handled event.
+
+        Parameters:
+        - entry: (time, seq, handler, args) entry of the event.
+        - elapsed: Wall time of the handler in ns.
+        - queue: Event queue, sampled every `sample_every` events.
+        """
+        name = getattr(entry[2], "__name__", "other")
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = StreamingHistogram()
+            self.counts[name] = 0
+            self.totals[name] = 0
+        histogram.add(elapsed)
+        self.counts[name] += 1
+        self.totals[name] += elapsed
+        self.events += 1
+        if self.events % self.sample_every == 0:
+            self.queue_sizes.append((self.events, entry[0], len(queue)))
+
+    def summary(self):
+        """Return the statistics of every event kind, slowest in total first."""
+        total = sum(self.totals.values()) or 1
+        summary = {}
+        for name in sorted(self.totals, key=self.totals.get, reverse=True):
+            histogram = self.histograms[name]
+            summary[name] = {
+                "count": self.counts[name],
+                "total_s": self.totals[name] / 1e9,
+                "share": self.totals[name] / total,
+                "mean_us": self.totals[name] / self.counts[name] / 1e3,
+                "p50_us": histogram.quantile(0.5) / 1e3,
+                "p90_us": histogram.quantile(0.9) / 1e3,
+                "p99_us": histogram.quantile(0.99) / 1e3,
+            }
+        return summary
+
+    def format(self):
+        """Return the summary as a table."""
+        lines = [
+            f"{'event':<24} {'count':>9} {'total s':>9} {'share':>7} "
+            f"{'mean us':>9} {'p50 us':>9} {'p90 us':>9} {'p99 us':>9}"
+        ]
+        for name, row in self.summary().items():
+            lines.append(
+                f"{name:<24} {row['count']:>9} {row['total_s']:>9.3f} "
+                f"{row['share']:>7.1%} {row['mean_us']:>9.1f} {row['p50_us']:>9.1f} "
+                f"{row['p90_us']:>9.1f} {row['p99_us']:>9.1f}"
+            )
+        return "\n".join(lines)
+
+
+class StackSampler:
+    def __init__(self, path, interval=0.001):
+        """
+        Initialize a sampling profiler of the main thread.
+
+        While running, the stack of the main thread is recorded every
+        `interval` seconds of CPU time, using a SIGPROF timer where the
+        platform has one and a background thread otherwise. A thread can
+        only sample when the main thread releases the GIL, which skews its
+        samples towards calls that do. On stop, the stacks are written to
+        `path` in the folded format read by flamegraph.pl and speedscope:
+        one "outer;...;inner count" line per distinct stack.
+
+        Parameters:
+        - path: File the folded stacks are written to.
+        - interval: Time between samples in seconds.
+        """
+        self.path = path
+        self.interval = interval
+        self.stacks = Counter()
+        self._thread = None
+        self._stop = threading.Event()
+        self._previous_handler = None
+
+    def _record(self, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+            frame = frame.f_back
+        if stack:
+            self.stacks[";".join(reversed(stack))] += 1
+
+    def _sample_thread(self, thread_id):
+        while not self._stop.wait(self.interval):
+            self._record(sys._current_frames().get(thread_id))
+
+    def start(self):
+        """Start sampling the main thread."""
+        if hasattr(signal, "setitimer"):
+            self._previous_handler = signal.signal(
+                signal.SIGPROF, lambda signum, frame: self._record(frame)
+            )
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        else:
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._sample_thread,
+                args=(threading.main_thread().ident,),
+                daemon=True,
+            )
+            self._thread.start()
+
+    def stop(self):
+        """Stop sampling and write the folded stacks."""
+        if self._thread is None:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            signal.signal(signal.SIGPROF, self._previous_handler)
+        else:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        with open(self.path, "w") as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f"{stack} {count}\n")
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,183 @@
+import os
+
+import numpy as np
+
+# Colors of the kinds of blocks in a rendered tree
+COLORS = {
+    "genesis": "red",
+    "longest_chain": "limegreen",
+    "fork": "darkgray",
+    "orphan": "orange",
+}
+
+
+def tree_layout(parents, depths):
+    """
+    Lay out a forest of blocks in linear time.
+
+    A block's x is its depth. Every block continues the row of its parent's
+    deepest subtree, so the longest chain is one straight row, and each
+    other branch gets the next free row when it is reached.
+
+    Parameters:
+    - parents: Array of the index of every block's parent, -1 for roots.
+      Parents must come before their children.
+    - depths: Array of the depth of every block.
+
+    Returns the arrays of the x and y positions of the blocks.
+    """
+    count = len(parents)
+    # Height of the subtree below each block, from the leaves up
+    heights = np.zeros(count, dtype=np.intp)
+    for i in range(count - 1, -1, -1):
+        parent = parents[i]
+        if parent >= 0 and heights[i] + 1 > heights[parent]:
+            heights[parent] = heights[i] + 1
+    children = [[] for _ in range(count)]
+    roots = []
+    for i in range(count):
+        if parents[i] >= 0:
+            children[parents[i]].append(i)
+        else:
+            roots.append(i)
+
+    rows = np.zeros(count, dtype=np.intp)
+    next_row = 0
+    for root in roots:
+        stack = [(root, None)]
+        while stack:
+            i, row = stack.pop()
+            if row is None:
+                row = next_row
+                next_row += 1
+            rows[i] = row
+            kids = children[i]
+            if not kids:
+                continue
+            spine = max(kids, key=heights.__getitem__)
+            stack += [(kid, None) for kid in kids if kid != spine]
+            stack.append((spine, row))  # Continue the row first
+    return np.asarray(depths, dtype=float), -rows.astype(float)
+
+
+def draw_blockchain(blockchain, ax, title=None, labels=None):
+    """
+    Draw the block tree of a blockchain on matplotlib axes.
+
+    All edges are drawn as one LineCollection and all blocks as one scatter,
+    so drawing costs a few calls whatever the size of the tree.
+
+    Parameters:
+    - blockchain: Blockchain to draw.
+    - ax: Matplotlib axes to draw on.
+    - title: Title of the axes.
+    - labels: Whether to label blocks with the start of their IDs, by
+      default only for trees of at most 50 blocks.
+    """
+    from matplotlib.collections import LineCollection
+
+    store = blockchain.store
+    flags = blockchain.block_flags()
+    serials = np.flatnonzero(flags)
+    index = np.full(len(flags), -1, dtype=np.intp)
+    index[serials] = np.arange(len(serials))
+    parents = np.array([store.parents[serial] for serial in serials.tolist()], dtype=np.intp)
+    # Parents the node does not have make their children roots
+    local_parents = np.where(parents >= 0, index[np.maximum(parents, 0)], -1)
+    depths = np.array([store.depths[serial] for serial in serials.tolist()])
+    x, y = tree_layout(local_parents, depths)
+
+    on_chain = np.zeros(len(serials), dtype=bool)
+    serial = store.serial(blockchain.get_tip())
+    while serial >= 0:
+        on_chain[index[serial]] = True
+        serial = store.parents[serial]
+    kinds = np.where(
+        flags[serials] == blockchain.ORPHAN,
+        "orphan",
+        np.where(on_chain, "longest_chain", "fork"),
+    )
+    kinds[serials == 0] = "genesis"
+
+    children = np.flatnonzero(local_parents >= 0)
+    segments = np.stack(
+        [
+            np.column_stack([x[local_parents[children]], y[local_parents[children]]]),
+            np.column_stack([x[children], y[children]]),
+        ],
+        axis=1,
+    )
+    ax.add_collection(LineCollection(segments, colors="black", linewidths=0.5, zorder=1))
+    ax.scatter(
+        x,
+        y,
+        c=[COLORS[kind] for kind in kinds.tolist()],
+        s=max(2.0, min(40.0, 4000 / max(len(serials), 1))),
+        edgecolors="none",
+        zorder=2,
+    )
+    if labels is None:
+        labels = len(serials) <= 50
+    if labels:
+        for i, serial in enumerate(serials.tolist()):
+            ax.annotate(
+                store.blocks[serial].block_id[:6],
+                (x[i], y[i]),
+                textcoords="offset points",
+                xytext=(0, 6),
+                ha="center",
+                fontsize=6,
+            )
+    ax.set_xlabel("Depth")
+    ax.set_yticks([])
+    ax.autoscale_view()
+    if title is not None:
+        ax.set_title(title)
+
+
+def render_blockchain(blockchain, path, title=None, figsize=(16, 6), dpi=150):
+    """
+    Render the block tree of a blockchain to an image file without a display.
+
+    Parameters:
+    - blockchain: Blockchain to render.
+    - path: Output file; the extension picks the format, such as .png or .svg.
+    - title: Title of the image.
+    - figsize: Size of the image in inches.
+    - dpi: Resolution of raster images.
+    """
+    # A bare Figure draws with the Agg canvas and never opens a window
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=figsize)
+    draw_blockchain(blockchain, figure.add_subplot(), title)
+    figure.savefig(path, dpi=dpi, bbox_inches="tight")
+
+
+def render_nodes(simulator, directory, nodes=None, format="png", **options):
+    """
+    Render the block trees of several nodes, one file per node.
+
+    Parameters:
+    - simulator: Simulator whose nodes are rendered.
+    - directory: Directory of the output files, created if missing.
+    - nodes: IDs of the nodes to render, None for all of them.
+    - format: Image format and file extension, such as "png" or "svg".
+    - options: Other keyword arguments of render_blockchain.
+
+    Returns the list of written paths.
+    """
+    os.makedirs(directory, exist_ok=True)
+    if nodes is None:
+        nodes = range(len(simulator.nodes))
+    paths = []
+    for node_id in nodes:
+        path = os.path.join(directory, f"node_{node_id}.{format}")
+        render_blockchain(
+            simulator.nodes[node_id].blockchain,
+            path,
+            title=f"Peer {node_id}'s Blockchain",
+            **options,
+        )
+        paths.append(path)
+    return paths
@@ -0,0 +1,64 @@
+import numpy as np
+
+
+class RandomStream:
+    # Largest number of samples drawn from the generator at once
+    MAX_BATCH_SIZE = 1024
+
+    def __init__(self, seed=None):
+        """
+        Initialize a stream of random numbers drawn in vectorized batches.
+
+        Each kind of sample is drawn from a numpy Generator in batches and
+        handed out one at a time, so callers pay one numpy call per batch
+        instead of one per sample. Batches start small and double up to
+        MAX_BATCH_SIZE, so streams that are rarely used stay small.
+
+        Parameters:
+        - seed: Seed or numpy SeedSequence of the underlying Generator.
+        """
+        self.generator = np.random.default_rng(seed)
+        self._exponentials = []
+        self._uniforms = []
+        self._batch_sizes = {"exponential": 16, "uniform": 16}
+
+    def _next_batch_size(self, kind):
+        """Return the size of the next batch of a kind of sample."""
+        size = self._batch_sizes[kind]
+        self._batch_sizes[kind] = min(2 * size, self.MAX_BATCH_SIZE)
+        return size
+
+    def exponential(self, scale=1.0):
+        """Return a sample from an exponential distribution with the given mean."""
+        if not self._exponentials:
+            self._exponentials = self.generator.standard_exponential(
+                self._next_batch_size("exponential")
+            ).tolist()
+        return scale * self._exponentials.pop()
+
+    def uniform(self, low=0.0, high=1.0):
+        """Return a sample from the uniform distribution over [low, high)."""
+        if not self._uniforms:
+            self._uniforms = self.generator.random(
+                self._next_batch_size("uniform")
+            ).tolist()
+        return low + (high - low) * self._uniforms.pop()
+
+    def integers(self, low, high):
+        """Return a random integer in [low, high)."""
+        return low + min(int(self.uniform() * (high - low)), high - low - 1)
+
+
+def child_seed(seed_sequence, index):
+    """
+    Return the `index`-th child of a SeedSequence.
+
+    The child is the one SeedSequence.spawn() would return at that position,
+    built without spawning the children before it, so a process can seed a
+    few of many streams cheaply.
+    """
+    return np.random.SeedSequence(
+        seed_sequence.entropy,
+        spawn_key=seed_sequence.spawn_key + (index,),
+        pool_size=seed_sequence.pool_size,
+    )
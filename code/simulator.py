@@ -1,8 +1,20 @@
-from graph import generate_connected_graph
-import heapq, random
+from topology import generate_topology
+import math, os, pickle
+from time import perf_counter_ns
 import numpy as np
 from peer import Peer, Node
-from event import Event, EventPriorityQueue
+from event import make_queue
+from rng import RandomStream, child_seed
+from transaction import TransactionStore
+from blockchain import BlockStore
+from tracelog import TraceRecorder
+from metrics import MetricsCollector
+from profiling import EventProfiler
+from export import BlockchainExporter
+
+
+# Format version of the files written by Simulator.save_checkpoint()
+CHECKPOINT_VERSION = 3
 
 
 class Simulator:
@@ -14,6 +26,14 @@ class Simulator:
         min_transactions_per_mining=3,
         transaction_mean_gap=15,
         max_events=100,
+        queue_backend="heap",
+        seed=None,
+        topology="random",
+        columnar_transactions=False,
+        trace_path=None,
+        metrics=False,
+        inventory_interval=20,
+        profile=False,
     ):
         """
         Initialize a Simulator object.
@@ -24,152 +44,484 @@ class Simulator:
         - z1: Parameter for generating CPU speeds.
         - min_transactions_per_mining: Minimum number of transactions required to mine a block.
         - transaction_mean_gap: Mean time gap between transactions.
-        - max_events: Maximum number of events to simulate.
+        - max_events: Maximum number of events to simulate, None for no limit.
+        - queue_backend: Event queue implementation, "heap" or "calendar".
+        - seed: Seed of all random numbers in the run, None for a fresh one.
+        - topology: Peer graph generator, one of topology.TOPOLOGIES.
+        - columnar_transactions: Keep the transactions of mined blocks in a
+          shared TransactionStore instead of Transaction objects.
+        - trace_path: File to record every processed event to, None to not record.
+        - metrics: Collect propagation, fork and mining share metrics in
+          `self.metrics`, a MetricsCollector.
+        - inventory_interval: Time between the inventory messages a node
+          sends to announce the transactions it received.
+        - profile: Time the handler of every event in `self.profiler`, an
+          EventProfiler. Runs use a separate loop when profiling, so a
+          simulator without it pays nothing.
         """
         self.peers = []
         self.nodes = []
+        self.metrics = MetricsCollector(self) if metrics else None
+        self.profiler = EventProfiler() if profile else None
         self.min_transactions_per_mining = min_transactions_per_mining
         self.transaction_mean_gap = transaction_mean_gap
-        self.graph = generate_connected_graph(n)
+        self.transaction_store = TransactionStore() if columnar_transactions else None
+        # Transactions are numbered per run, so the seed fixes their IDs and
+        # the block IDs hashed from them; see new_transaction_id
+        self.next_transaction_id = 0
+        self.transaction_id_stride = 1
+        # Every transaction created in the run by ID, for answering requests
+        self.transactions = {}
+        self.inventory_interval = inventory_interval
+        # Every block of the run, shared by the nodes' blockchains
+        self.block_store = BlockStore()
+        # Independent random streams for the topology (child 0), the network
+        # setup (child 1) and every node (child i + 2) of the seed, so that
+        # runs with the same seed are identical
+        self.seed = seed
+        self.seed_sequence = np.random.SeedSequence(seed)
+        self.rng = np.random.default_rng(child_seed(self.seed_sequence, 1))
+        self.graph = generate_topology(
+            topology, n, np.random.default_rng(child_seed(self.seed_sequence, 0))
+        )
         speeds = self.generate_array_random(n, z0)
         CPU_speeds = self.generate_array_random(n, z1)
         self.h = 1 / (n + 9 * sum(CPU_speeds))
 
         # Initialize nodes and peers
-        for i in range(n):
-            node = Node(
-                i, speeds[i], CPU_speeds[i], self.min_transactions_per_mining, self
-            )
-            self.nodes.append(node)
-            self.peers.append(Peer(node, n, self))
+        self.create_nodes(speeds, CPU_speeds)
 
         # Connect peers in the network
         self.connect_peers()
 
-        # Initialize latencies matrix
-        self.latencies = [[0 for _ in range(n)] for _ in range(n)]
-        self.longest_chains = [
-            node.blockchain.get_longest_chain() for node in self.nodes
-        ]
-
-        # Generate latencies matrix
-        for i in range(n):
-            for j in range(n):
-                if i != j:
-                    ij = np.random.uniform(10, 500)
-                    cij = 100 if (self.nodes[i].speed and self.nodes[j].speed) else 5
-                    dij = np.random.exponential(96 / cij)
-                    self.latencies[i][j] = ij + dij
-                else:
-                    self.latencies[i][j] = 0
+        # Longest chain held by any node and deepest reorganization seen so
+        # far; every node starts with only the genesis block
+        self.max_chain_length = self.block_store.depths[0]
+        self.max_fork_depth = 0
+
+        self.generate_latencies(speeds)
 
         # Initialize priority queue and generate initial transactions
-        self.priority_queue = EventPriorityQueue()
+        self.priority_queue = make_queue(queue_backend)
         self.generate_transactions_init()
         self.max_events = max_events
+        self.current_time = 0
+        self.events_processed = 0
+        # Why the last run stopped: "max_events", "until_time", "until" or "empty"
+        self.stop_reason = None
+        self.trace = TraceRecorder(trace_path) if trace_path is not None else None
+
+    def new_transaction_id(self):
+        """Return the ID of a new transaction of the run."""
+        txn_id = self.next_transaction_id
+        self.next_transaction_id += self.transaction_id_stride
+        return txn_id
+
+    def create_nodes(self, speeds, CPU_speeds):
+        """
+        Create the node and peer of every node ID.
+
+        Parameters:
+        - speeds: List of the speed of every node, 1 for fast.
+        - CPU_speeds: List of the CPU speed of every node, 1 for high.
+        """
+        for i in range(self.graph.n):
+            node, peer = self.create_node(i, speeds[i], CPU_speeds[i])
+            self.nodes.append(node)
+            self.peers.append(peer)
+
+    def create_node(self, i, speed, CPU_speed):
+        """Create node i and its peer, with the node's own random stream."""
+        node = Node(
+            i,
+            speed,
+            CPU_speed,
+            self.min_transactions_per_mining,
+            self,
+            rng=RandomStream(child_seed(self.seed_sequence, i + 2)),
+        )
+        return node, Peer(node, self.graph.n, self)
 
     def generate_array_random(self, n, z):
         """Generate a random array of length n with z proportion of ones."""
         num_ones = int(n * z)
         num_zeros = n - num_ones
         array = [1] * num_ones + [0] * num_zeros
-        random.shuffle(array)
+        self.rng.shuffle(array)
         return array
 
-    def simulate(self):
-        """Simulate the events in the network."""
-        for i in range(self.max_events):
-            self.event_handler()
+    def generate_latencies(self, speeds):
+        """
+        Generate the latency parameters of every directed link.
+
+        Both arrays are aligned with graph.indices: link_rates holds c_ij,
+        100 between two fast nodes and 5 otherwise, and latencies holds
+        rho_ij + d_ij.
+
+        Parameters:
+        - speeds: List of the speed of every node, 1 for fast.
+        """
+        fast = np.array(speeds, dtype=bool)
+        fast_links = fast[self.graph.edge_sources()] & fast[self.graph.indices]
+        links = len(self.graph.indices)
+        self.link_rates = np.where(fast_links, 100.0, 5.0)
+        # d_ij is exponential with mean 96 / c_ij
+        self.latencies = self.rng.standard_exponential(links)
+        self.latencies *= np.where(fast_links, 96 / 100, 96 / 5)
+        self.latencies += self.rng.uniform(10, 500, links)
+
+    def simulate(
+        self,
+        until_time=None,
+        until=None,
+        max_events=None,
+        checkpoint_path=None,
+        checkpoint_every=None,
+    ):
+        """
+        Simulate the events in the network.
+
+        Parameters:
+        - until_time: Stop before the first event scheduled after this time.
+        - until: Predicate called with the simulator after every event; the
+          run stops as soon as it returns True.
+        - max_events: Maximum number of events to process, defaults to the
+          simulator's max_events.
+        - checkpoint_path: File that save_checkpoint() writes to every
+          `checkpoint_every` events and when the run stops.
+        - checkpoint_every: Number of events between checkpoints, None to
+          not checkpoint.
+
+        The run also stops when the event queue is empty. Returns the number
+        of events processed.
+        """
+        if max_events is None:
+            max_events = self.max_events
+        limit = math.inf if max_events is None else max_events
+        if checkpoint_path is None or checkpoint_every is None:
+            processed, self.stop_reason = self._run(limit, until_time, until)
+        else:
+            processed = 0
+            while True:
+                done, reason = self._run(
+                    min(checkpoint_every, limit - processed), until_time, until
+                )
+                processed += done
+                self.stop_reason = reason
+                self.save_checkpoint(checkpoint_path)
+                if reason != "max_events" or processed >= limit:
+                    break
+        if self.trace is not None:
+            self.trace.flush()
+        return processed
+
+    def simulate_iter(self, batch_size=1000, until_time=None, until=None, max_events=None):
+        """
+        Simulate the events in the network, yielding after every batch.
+
+        Parameters:
+        - batch_size: Number of events processed between two yields.
+        - until_time, until, max_events: Stopping conditions, as in simulate().
+
+        Yields lists of the processed (time, seq, handler, args) entries. The
+        caller can stop the run at any time by leaving the loop.
+        """
+        if max_events is None:
+            max_events = self.max_events
+        remaining = math.inf if max_events is None else max_events
+        while remaining > 0:
+            batch = []
+            processed, reason = self._run(
+                min(batch_size, remaining), until_time, until, batch
+            )
+            remaining -= processed
+            if self.trace is not None:
+                self.trace.flush()
+            if batch:
+                yield batch
+            if reason is not None:
+                self.stop_reason = reason
+                return
+        self.stop_reason = "max_events"
+
+    def _run(self, limit, until_time, until, batch=None):
+        """
+        Process up to `limit` events.
+
+        Returns the number of events processed and the reason the run stopped
+        early, which is "max_events" when `limit` was reached.
+        """
+        if self.profiler is not None:
+            return self._run_profiled(limit, until_time, until, batch)
+        queue = self.priority_queue
+        pop_entry = queue.pop_entry
+        trace = self.trace
+        processed = 0
+        reason = "max_events"
+        while processed < limit:
+            if not queue:
+                reason = "empty"
+                break
+            if until_time is not None and queue.peek_entry()[0] > until_time:
+                reason = "until_time"
+                break
+            entry = pop_entry()
+            self.current_time = entry[0]
+            entry[2](*entry[3])
+            processed += 1
+            if trace is not None:
+                trace.record_entry(entry, self.block_store)
+            if batch is not None:
+                batch.append(entry)
+            if until is not None and until(self):
+                reason = "until"
+                break
+        self.events_processed += processed
+        if batch is not None and reason == "max_events":
+            # Only the batch size was reached, the caller decides what's next
+            reason = None
+        return processed, reason
+
+    def _run_profiled(self, limit, until_time, until, batch=None):
+        """Process up to `limit` events like _run, timing every handler."""
+        queue = self.priority_queue
+        pop_entry = queue.pop_entry
+        trace = self.trace
+        record = self.profiler.record
+        clock = perf_counter_ns
+        processed = 0
+        reason = "max_events"
+        while processed < limit:
+            if not queue:
+                reason = "empty"
+                break
+            if until_time is not None and queue.peek_entry()[0] > until_time:
+                reason = "until_time"
+                break
+            entry = pop_entry()
+            self.current_time = entry[0]
+            start = clock()
+            entry[2](*entry[3])
+            record(entry, clock() - start, queue)
+            processed += 1
+            if trace is not None:
+                trace.record_entry(entry, self.block_store)
+            if batch is not None:
+                batch.append(entry)
+            if until is not None and until(self):
+                reason = "until"
+                break
+        self.events_processed += processed
+        if batch is not None and reason == "max_events":
+            reason = None
+        return processed, reason
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # Node and Peer links are pickled as node IDs
+        for node in self.nodes:
+            node.peers = [self.peers[j] for j in node.peers]
+        for peer in self.peers:
+            peer.connections = [self.peers[j] for j in peer.connections]
+
+    def save_checkpoint(self, path):
+        """
+        Save the full state of the simulation to a file.
+
+        The checkpoint holds the event queue, every node and peer with its
+        blockchain view, transaction pool and random stream, and the shared
+        block store. Blocks and transactions are saved once, and balances
+        are recomputed when loading. The file is replaced atomically, so a
+        crash while saving keeps the previous checkpoint.
+
+        Parameters:
+        - path: Path of the checkpoint file.
+        """
+        checkpoint = {
+            "version": CHECKPOINT_VERSION,
+            "simulator": self,
+        }
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "wb") as file:
+            pickle.dump(checkpoint, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load_checkpoint(cls, path, trace_path=None):
+        """
+        Load a simulation saved by save_checkpoint(), ready to continue.
+
+        A checkpoint can be loaded any number of times to fork a warmed-up
+        network into independent continuations.
+
+        Parameters:
+        - path: Path of the checkpoint file.
+        - trace_path: File to record the continuation's events to. When None,
+          the trace file of the saved run is truncated back to the events
+          recorded at the checkpoint and continued, so forks of one
+          checkpoint need their own trace_path.
+        """
+        with open(path, "rb") as file:
+            checkpoint = pickle.load(file)
+        if checkpoint.get("version") != CHECKPOINT_VERSION:
+            raise ValueError(
+                f"Unsupported checkpoint version {checkpoint.get('version')!r}"
+            )
+        simulator = checkpoint["simulator"]
+        if trace_path is not None:
+            simulator.trace = TraceRecorder(trace_path)
+        elif simulator.trace is not None:
+            simulator.trace.reopen()
+        return simulator
 
     def connect_peers(self):
         """Connect peers in the network based on the generated graph."""
-        for i, row in enumerate(self.graph):
-            for j, connected in enumerate(row):
+        # Peers end up in increasing ID order, matching graph.neighbors()
+        for i in range(self.graph.n):
+            for j in self.graph.neighbors(i).tolist():
                 if j <= i:
                     continue
-                if connected:
-                    self.peers[i].connect_to_peer(self.peers[j])
-                    self.nodes[i].add_peer(self.peers[j])
-                    self.peers[j].connect_to_peer(self.peers[i])
-                    self.nodes[j].add_peer(self.peers[i])
+                self.peers[i].connect_to_peer(self.peers[j])
+                self.nodes[i].add_peer(self.peers[j])
+                self.peers[j].connect_to_peer(self.peers[i])
+                self.nodes[j].add_peer(self.peers[i])
 
     def generate_transactions_init(self):
         """Generate initial transactions for all peers."""
         for peer in self.peers:
-            event = Event(peer, "generate_transactions", {"time": 0}, 0)
-            self.priority_queue.push(event)
+            self.priority_queue.schedule(0, peer.generate_transactions, (0,))
 
     def get_latency(self, i, j, messg_size=1):
-        """Calculate the latency between two nodes."""
-        cij = 100 if (self.nodes[i].speed and self.nodes[j].speed) else 5
-        return self.latencies[i][j] + messg_size / cij
+        """Calculate the latency between two connected nodes."""
+        link = self.graph.edge_index(i, j)
+        if link is None:
+            raise ValueError(f"Nodes {i} and {j} are not connected")
+        return float(self.latencies[link] + messg_size / self.link_rates[link])
+
+    def get_latencies(self, i, messg_size=1):
+        """Calculate the latencies from node i to each of its peers, in peer order."""
+        start, end = self.graph.indptr[i], self.graph.indptr[i + 1]
+        return self.latencies[start:end] + messg_size / self.link_rates[start:end]
 
     def event_handler(self):
-        """Handle the events in the priority queue."""
-        if not self.priority_queue.is_empty():
-            event = self.priority_queue.pop()
-            if event.function == "receive_block":
-                index = self.peers.index(event.object)
-                longest_chain_before = event.object.node.blockchain.get_longest_chain()
-                if hasattr(event.object, event.function):
-                    method = getattr(event.object, event.function)
-                    if event.params is not None:
-                        method(**event.params)
-                    else:
-                        method()
-                longest_chain_after = event.object.node.blockchain.get_longest_chain()
-                self.longest_chains[index] = longest_chain_after
-                Tk = np.random.exponential(
-                    self.nodes[index].avg_time / 10 * self.h
-                    if self.nodes[index].CPU_speed == 1
-                    else self.h
-                )
-                if longest_chain_before != longest_chain_after[:-1]:
-                    self.priority_queue.push(
-                        Event(
-                            self.nodes[index],
-                            "conditional_mine_block",
-                            {
-                                "prev_longest_chain": longest_chain_after,
-                                "time": event.time + Tk,
-                            },
-                            event.time + Tk,
-                        )
-                    )
-                    pass
-            else:
-                if hasattr(event.object, event.function):
-                    method = getattr(event.object, event.function)
-                    if event.params is not None:
-                        method(**event.params)
-                    else:
-                        method()
+        """Handle the next event in the priority queue, returning it or None if empty."""
+        if self.priority_queue.is_empty():
+            return None
+        entry = self.priority_queue.pop_entry()
+        self.current_time = entry[0]
+        if self.profiler is None:
+            entry[2](*entry[3])
         else:
-            print("Events are empty")
+            start = perf_counter_ns()
+            entry[2](*entry[3])
+            self.profiler.record(
+                entry, perf_counter_ns() - start, self.priority_queue
+            )
+        self.events_processed += 1
+        if self.trace is not None:
+            self.trace.record_entry(entry, self.block_store)
+        return entry
 
-    def is_proper_prefix(self, list1, list2):
-        """Check if list1 is a proper prefix of list2."""
-        if len(list1) < len(list2):
-            return all(list1[i] == list2[i] for i in range(len(list1)))
-        else:
-            return False
+    def deliver_block(self, peer, block, time, sender=None):
+        """
+        Deliver a block to a peer and start mining if its tip changed.
+
+        Parameters:
+        - peer: Peer receiving the block.
+        - block: Block being delivered.
+        - time: Time at which the block is received.
+        - sender: ID of the node that sent the block.
+        """
+        node = peer.node
+        tip_before = node.blockchain.get_tip()
+        peer.receive_block(block, time)
+        tip_after = node.blockchain.get_tip()
+        if tip_after is tip_before:
+            return
+        self.update_chain_length(node)
+        if tip_after.previous_block_id != tip_before.block_id:
+            depth = node.blockchain.get_reorg_depth(tip_before)
+            self.max_fork_depth = max(self.max_fork_depth, depth)
+            if self.metrics is not None and depth:
+                self.metrics.on_reorg(depth)
+        node.schedule_mining(time)
+
+    @property
+    def longest_chains(self):
+        """List of the longest chain of every node, built on demand."""
+        return [node.blockchain.get_longest_chain() for node in self.nodes]
 
-    def print_blockchain(self):
-        """Print the blockchain of each node to a file."""
-        with open("blockchain.txt", "w") as file:
+    def update_chain_length(self, node):
+        """Record the height of a node's longest chain after its blockchain changed."""
+        height = node.blockchain.get_height()
+        if height > self.max_chain_length:
+            self.max_chain_length = height
+
+    def print_blockchain(self, path="blockchain.txt"):
+        """
+        Print the blockchain of each node to a text file.
+
+        The text of each block is built once and shared by every node that
+        stores it, and each node's blockchain is written in one call. Use
+        export_blockchain() for large runs, as this file repeats every
+        block once per node.
+        """
+        texts = {}
+        store = self.block_store
+        with open(path, "w") as file:
             for node in self.nodes:
-                file.write(f"Node {node.id} Blockchain:\n")
+                parts = [f"Node {node.id} Blockchain:\n"]
                 for block in node.blockchain.blocks:
-                    file.write("Block ID: " + str(block.block_id) + "\n")
-                    file.write(
-                        "Previous Block ID: " + str(block.previous_block_id) + "\n"
-                    )
-                    file.write("Transactions:\n")
-                    for txn in block.transactions:
-                        file.write(str(txn) + "\n")
-                    file.write("\n")
-
-    def visualize(self):
-        """Visualize the blockchain of each node."""
-        for node in self.nodes:
-            node.blockchain.visualize(node.id)
+                    serial = store.serial(block)
+                    text = texts.get(serial)
+                    if text is None:
+                        text = texts[serial] = (
+                            f"Block ID: {block.block_id}\n"
+                            f"Previous Block ID: {block.previous_block_id}\n"
+                            "Transactions:\n"
+                            + "".join(f"{txn}\n" for txn in block.transactions)
+                            + "\n"
+                        )
+                    parts.append(text)
+                file.write("".join(parts))
+
+    def export_blockchain(self, path, format="jsonl", compression="infer"):
+        """
+        Export every block once, with each node's blocks and tip, to a file.
+
+        Parameters:
+        - path: Path of the export file, compressed if it ends in .gz or .zst.
+        - format: "jsonl" or "binary", see export.BlockchainExporter.
+        - compression: "gzip", "zstd", None, or "infer" from the file name.
+
+        Use a BlockchainExporter directly to export incrementally during a run.
+        """
+        with BlockchainExporter(path, format, compression) as exporter:
+            exporter.export(self)
+
+    def visualize(self, directory=None, nodes=None, format="png"):
+        """
+        Visualize the blockchain of each node.
+
+        Parameters:
+        - directory: Directory to write one image per node to, None to show
+          the trees interactively one after the other.
+        - nodes: IDs of the nodes to visualize, None for all of them.
+        - format: Image format when writing files, such as "png" or "svg".
+        """
+        if directory is not None:
+            from render import render_nodes
+
+            return render_nodes(self, directory, nodes, format)
+        for node_id in nodes if nodes is not None else range(len(self.nodes)):
+            self.nodes[node_id].blockchain.visualize(node_id)
+
+
+def chain_length_at_least(length):
+    """Return a stopping predicate for simulate() that fires once any node's longest chain has `length` blocks."""
+    return lambda simulator: simulator.max_chain_length >= length
+
+
+def fork_depth_at_least(depth):
+    """Return a stopping predicate for simulate() that fires once any node abandons `depth` blocks in a reorganization."""
+    return lambda simulator: simulator.max_fork_depth >= depth
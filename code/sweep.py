@@ -0,0 +1,182 @@
+import argparse
+import csv
+import hashlib
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from event import QUEUE_BACKENDS
+from simulator import Simulator
+
+# Parameters identifying a run, used to skip finished runs when resuming
+KEY_FIELDS = [
+    "peers",
+    "z0",
+    "z1",
+    "transaction_mean_gap",
+    "replicate",
+    "seed",
+    "min_transactions_per_mining",
+    "max_events",
+    "until_time",
+    "queue_backend",
+]
+FIELDS = KEY_FIELDS + [
+    "events",
+    "sim_time",
+    "wall_time",
+    "chain_length",
+    "blocks",
+    "max_fork_depth",
+    "stale_ratio",
+    "propagation_p50",
+    "propagation_p99",
+]
+
+
+def run_seed(base_seed, combination, replicate):
+    """
+    Derive the seed of a run from the sweep's base seed, so that every run
+    has its own random stream.
+
+    Parameters:
+    - base_seed: Base seed of the sweep.
+    - combination: Tuple of the run's swept parameter values. The seed
+      depends on the values, not on their position in the sweep, so adding
+      values to a sweep keeps the seeds of the runs already finished.
+    - replicate: Index of the run among the runs of its combination.
+    """
+    digest = hashlib.sha256(repr(combination).encode()).digest()
+    entropy = [base_seed, int.from_bytes(digest[:8], "little"), replicate]
+    return int(np.random.SeedSequence(entropy).generate_state(1)[0])
+
+
+def run_key(row):
+    """Return the parameters identifying a run as a tuple of strings, as written to the CSV file."""
+    return tuple("" if row[field] is None else str(row[field]) for field in KEY_FIELDS)
+
+
+def summarize(simulator):
+    """Summarize a finished simulation as a dict of result columns."""
+    metrics = simulator.metrics.summary()
+    propagation = metrics["propagation_delay"]
+    return {
+        "events": simulator.events_processed,
+        "sim_time": simulator.current_time,
+        "chain_length": simulator.max_chain_length,
+        "blocks": len(simulator.block_store.blocks) - 1,  # Exclude the genesis block
+        "max_fork_depth": simulator.max_fork_depth,
+        "stale_ratio": metrics["stale_ratio"],
+        "propagation_p50": propagation.get("p50"),
+        "propagation_p99": propagation.get("p99"),
+    }
+
+
+def run(run_config):
+    """
+    Run a single simulation of the sweep in a worker process.
+
+    Parameters:
+    - run_config: Dict with the run's key fields, seed and simulation limits.
+
+    Returns the run's row for the results file.
+    """
+    start = time.perf_counter()
+    simulator = Simulator(
+        run_config["peers"],
+        run_config["z0"],
+        run_config["z1"],
+        min_transactions_per_mining=run_config["min_transactions_per_mining"],
+        transaction_mean_gap=run_config["transaction_mean_gap"],
+        max_events=run_config["max_events"] or None,
+        queue_backend=run_config["queue_backend"],
+        seed=run_config["seed"],
+        metrics=True,
+    )
+    simulator.simulate(until_time=run_config["until_time"])
+    row = {field: run_config[field] for field in KEY_FIELDS}
+    row.update(summarize(simulator))
+    row["wall_time"] = time.perf_counter() - start
+    return row
+
+
+def load_finished(path):
+    """Return the keys of the runs already written to a results file."""
+    if not os.path.exists(path) or not os.path.getsize(path):
+        return set()
+    with open(path, newline="") as file:
+        reader = csv.DictReader(file)
+        if reader.fieldnames != FIELDS:
+            raise ValueError(
+                f"{path} has other columns than this version of the sweep writes"
+            )
+        return {run_key(row) for row in reader}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run a parameter sweep of simulations in parallel"
+    )
+    parser.add_argument("--peers", nargs="+", type=int, required=True)
+    parser.add_argument("--z0", nargs="+", type=float, required=True)
+    parser.add_argument("--z1", nargs="+", type=float, required=True)
+    parser.add_argument("--transaction-mean-gap", nargs="+", type=float, required=True)
+    parser.add_argument("--replicates", type=int, default=1, help="Runs per combination")
+    parser.add_argument("--seed", type=int, default=0, help="Base seed of the sweep")
+    parser.add_argument("--min-transactions-per-mining", type=int, default=10)
+    parser.add_argument(
+        "--max-events", type=int, default=10000, help="Event budget of each run, 0 for no limit"
+    )
+    parser.add_argument("--until-time", type=float, default=None)
+    parser.add_argument("--queue-backend", choices=sorted(QUEUE_BACKENDS), default="heap")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--output", default="sweep.csv", help="CSV results file")
+    args = parser.parse_args()
+
+    try:
+        finished = load_finished(args.output)
+    except ValueError as error:
+        parser.error(str(error))
+    runs = []
+    for peers, z0, z1, gap, replicate in itertools.product(
+        args.peers,
+        args.z0,
+        args.z1,
+        args.transaction_mean_gap,
+        range(args.replicates),
+    ):
+        run_config = {
+            "peers": peers,
+            "z0": z0,
+            "z1": z1,
+            "transaction_mean_gap": gap,
+            "replicate": replicate,
+            "seed": run_seed(args.seed, (peers, z0, z1, gap), replicate),
+            "min_transactions_per_mining": args.min_transactions_per_mining,
+            "max_events": args.max_events,
+            "until_time": args.until_time,
+            "queue_backend": args.queue_backend,
+        }
+        if run_key(run_config) not in finished:
+            runs.append(run_config)
+    print(f"{len(finished)} runs already in {args.output}, {len(runs)} to run")
+
+    write_header = not os.path.exists(args.output) or not os.path.getsize(args.output)
+    with open(args.output, "a", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=FIELDS)
+        if write_header:
+            writer.writeheader()
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            futures = [executor.submit(run, run_config) for run_config in runs]
+            for done, future in enumerate(as_completed(futures), 1):
+                writer.writerow(future.result())
+                file.flush()  # Keep finished runs if the sweep is interrupted
+                print(f"{done}/{len(runs)} runs done", end="\r")
+    print()
+
+
+if __name__ == "__main__":
+    main()
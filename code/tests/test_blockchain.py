@@ -0,0 +1,190 @@
+import hashlib
+import random
+
+from blockchain import (
+    GENESIS_BLOCK,
+    INITIAL_BALANCE,
+    BalanceState,
+    Block,
+    Blockchain,
+    BlockStore,
+    BlockTemplate,
+    transaction_digest,
+)
+from transaction import Transaction
+
+
+def random_tree(rng, store, count):
+    """Register `count` blocks with random parents in a store, parents first."""
+    blocks = [GENESIS_BLOCK]
+    for i in range(count):
+        parent = rng.choice(blocks)
+        block = Block(f"b{i}", parent.block_id, [Transaction(-1, rng.randrange(10), 50)])
+        store.register(block)
+        blocks.append(block)
+    return blocks[1:]
+
+
+def test_views_connect_orphans_in_any_order():
+    rng = random.Random(3)
+    store = BlockStore()
+    blocks = random_tree(rng, store, 300)
+    chain = Blockchain(block_store=store)
+    order = blocks[:]
+    rng.shuffle(order)
+    added = {}
+    for block in order:
+        assert chain.add_block(block)
+        assert not chain.add_block(block)
+        added[block.block_id] = len(added)
+        # A block is connected exactly when all its ancestors are stored
+        flags = chain.block_flags()
+        best, best_order, tip = 1, -1, GENESIS_BLOCK
+        for other in blocks:
+            serial = store.serial(other)
+            if other.block_id not in added:
+                assert serial >= len(flags) or flags[serial] == Blockchain.UNKNOWN
+                continue
+            connected = True
+            ancestor = store.parents[serial]
+            while ancestor > 0:
+                connected = connected and store.blocks[ancestor].block_id in added
+                ancestor = store.parents[ancestor]
+            assert flags[serial] == (Blockchain.CONNECTED if connected else Blockchain.ORPHAN)
+            if not connected:
+                continue
+            # Of equally long chains, the tip stored first wins
+            depth, stored = store.depths[serial], added[other.block_id]
+            if depth > best or (depth == best and stored < best_order):
+                best, best_order, tip = depth, stored, other
+        assert chain.get_height() == best
+        assert chain.get_tip() is tip
+    assert len(chain) == len(blocks) + 1
+    longest = chain.get_longest_chain()
+    assert longest[0] is GENESIS_BLOCK and len(longest) == chain.get_height()
+    for parent, child in zip(longest, longest[1:]):
+        assert child.previous_block_id == parent.block_id
+
+
+def test_equally_long_orphans_keep_the_first_stored():
+    # Blocks are registered parents first, as when they are mined, and reach
+    # the view in another order
+    store = BlockStore()
+    parent, first, second, third = (
+        Block("p", "0", ()), Block("a", "p", ()), Block("b", "p", ()), Block("c", "p", ())
+    )
+    for block in (parent, first, second, third):
+        store.register(block)
+    chain = Blockchain(block_store=store)
+    for block in (first, second, parent):
+        chain.add_block(block)
+    assert chain.get_tip() is first
+    chain.add_block(third)
+    assert chain.get_tip() is first
+
+
+def test_store_depths_and_reorg_depth():
+    store = BlockStore()
+    chain = Blockchain(block_store=store)
+    a1 = Block("a1", "0", ())
+    a2 = Block("a2", "a1", ())
+    b1 = Block("b1", "0", ())
+    b2 = Block("b2", "b1", ())
+    b3 = Block("b3", "b2", ())
+    for block in (a1, a2):
+        chain.add_block(block)
+    old_tip = chain.get_tip()
+    for block in (b1, b2, b3):
+        chain.add_block(block)
+    assert [store.depths[store.serial(block)] for block in (a1, a2, b3)] == [2, 3, 4]
+    assert chain.get_tip() is b3
+    assert chain.get_reorg_depth(old_tip) == 2
+    assert chain.find_block_by_id("b2") is b2
+    assert Blockchain(block_store=store).find_block_by_id("b2") is None
+
+
+def test_validation_uses_the_parent_chain():
+    store = BlockStore()
+    rich = Block("rich", "0", [Transaction(-1, 1, 50)])
+    spend = Block("spend", "rich", [Transaction(1, 2, INITIAL_BALANCE + 50)])
+    overspend = Block("overspend", "0", [Transaction(1, 2, INITIAL_BALANCE + 50)])
+    for block in (rich, spend, overspend):
+        store.register(block)
+    assert store.is_valid(store.serial(spend))
+    assert not store.is_valid(store.serial(overspend))
+    assert store.states[store.serial(spend)].get(2) == INITIAL_BALANCE * 2 + 50
+
+
+def test_balance_state_flattening_matches_a_plain_dict():
+    rng = random.Random(4)
+    state = BalanceState()
+    expected = {}
+    for step in range(5 * BalanceState.MAX_LAYERS):
+        transactions = []
+        for _ in range(rng.randrange(4)):
+            sender = rng.choice([-1] + list(range(20)))
+            receiver = rng.randrange(20)
+            amount = rng.randrange(1, 100)
+            transactions.append(Transaction(sender, receiver, amount))
+            if sender != -1:
+                expected[sender] = expected.get(sender, INITIAL_BALANCE) - amount
+            expected[receiver] = expected.get(receiver, INITIAL_BALANCE) + amount
+        state = state.apply(transactions)
+        assert state.layers <= BalanceState.MAX_LAYERS
+        for account in range(21):
+            assert state.get(account) == expected.get(account, INITIAL_BALANCE)
+
+
+def reference_merkle_root(transactions):
+    """Hash the perfect subtrees of the binary decomposition, largest first, then fold them right to left."""
+    leaves = [transaction_digest(transaction) for transaction in transactions]
+    peaks = []
+    start = 0
+    size = 1 << max(len(leaves).bit_length() - 1, 0)
+    while start < len(leaves):
+        if start + size <= len(leaves):
+            level = leaves[start : start + size]
+            while len(level) > 1:
+                level = [
+                    hashlib.sha1(level[i] + level[i + 1]).digest()
+                    for i in range(0, len(level), 2)
+                ]
+            peaks.append(level[0])
+            start += size
+        size //= 2
+    if not peaks:
+        return hashlib.sha1().digest()
+    root = peaks[-1]
+    for digest in reversed(peaks[:-1]):
+        root = hashlib.sha1(digest + root).digest()
+    return root
+
+
+def test_template_merkle_root_is_incremental():
+    rng = random.Random(5)
+    template = BlockTemplate()
+    pending = {}
+    assert template.merkle_root() == reference_merkle_root([])
+    for step in range(300):
+        if pending and rng.random() < 0.2:
+            txn_id = rng.choice(list(pending))
+            template.discard(txn_id)
+            del pending[txn_id]
+        else:
+            transaction = Transaction(rng.randrange(10), rng.randrange(10), 5, txn_id=step)
+            assert template.add(transaction)
+            assert not template.add(transaction)
+            pending[step] = transaction
+        assert len(template) == len(pending)
+        assert template.merkle_root() == reference_merkle_root(pending.values())
+    template.clear()
+    assert template.merkle_root() == reference_merkle_root([])
+
+
+def test_created_blocks_have_unique_ids():
+    store = BlockStore()
+    first, second = Blockchain(block_store=store), Blockchain(block_store=store)
+    transactions = [Transaction(-1, 0, 50, txn_id=0)]
+    ids = {first.create_block(transactions, 0).block_id for _ in range(20)}
+    ids |= {second.create_block(transactions, 1).block_id for _ in range(20)}
+    assert len(ids) == 40
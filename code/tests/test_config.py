@@ -0,0 +1,106 @@
+import pytest
+
+from config import DEFAULTS, TYPES, load_config, resolve, simulator_options
+from main import parse_args
+
+REQUIRED = {"peers": 10, "z0": 0.5, "z1": 0.5, "transaction_mean_gap": 10}
+
+
+def test_toml_and_yaml_files_give_the_same_settings(tmp_path):
+    toml = tmp_path / "run.toml"
+    toml.write_text(
+        'peers = 10\nz0 = 0.5\nqueue-backend = "calendar"\nuntil_time = 500.0\n'
+    )
+    yaml = tmp_path / "run.yaml"
+    yaml.write_text("peers: 10\nz0: 0.5\nqueue-backend: calendar\nuntil_time: 500.0\n")
+    expected = {"peers": 10, "z0": 0.5, "queue_backend": "calendar", "until_time": 500.0}
+    assert load_config(str(toml)) == expected
+    assert load_config(str(yaml)) == expected
+
+
+def test_command_line_overrides_file_overrides_defaults():
+    settings = resolve(
+        {**REQUIRED, "seed": 1, "max_events": 50}, {"seed": 2, "max_events": None}
+    )
+    assert settings["seed"] == 2
+    assert settings["max_events"] == 50
+    assert settings["min_transactions_per_mining"] == DEFAULTS["min_transactions_per_mining"]
+    assert simulator_options(settings)["n"] == 10
+
+
+@pytest.mark.parametrize(
+    "config",
+    [
+        {"topology": "nope"},
+        {"queue_backend": "nope"},
+        {"export_format": "nope"},
+        {"peers": None},
+        {"peers": "10"},
+        {"peers": 10.5},
+        {"peers": True},
+        {"z0": "half"},
+        {"columnar_transactions": 1},
+        {"print_blockchain": 1},
+        {"trace": False},
+        {"render_nodes": [0, "1"]},
+    ],
+)
+def test_invalid_settings_are_rejected(config):
+    with pytest.raises(ValueError):
+        resolve({**REQUIRED, **config}, {})
+
+
+def test_unknown_keys_are_rejected(tmp_path):
+    path = tmp_path / "run.toml"
+    path.write_text("peer = 10\n")
+    with pytest.raises(ValueError, match="peer"):
+        load_config(str(path))
+
+
+@pytest.mark.parametrize(
+    "argv",
+    [
+        ["--topology", "nope"],
+        ["--queue-backend", "nope"],
+        ["--export-format", "nope"],
+        ["--workers", "2", "--metrics", "metrics.json"],
+    ],
+)
+def test_bad_command_lines_are_usage_errors(argv, tmp_path):
+    config = tmp_path / "run.toml"
+    config.write_text("peers = 10\nz0 = 0.5\nz1 = 0.5\ntransaction_mean_gap = 10\n")
+    with pytest.raises(SystemExit) as error:
+        parse_args(["--config", str(config), *argv])
+    assert error.value.code == 2
+
+
+def test_config_file_values_are_checked(tmp_path):
+    config = tmp_path / "run.toml"
+    config.write_text(
+        'peers = 10\nz0 = 0.5\nz1 = 0.5\ntransaction_mean_gap = 10\ntopology = "nope"\n'
+    )
+    with pytest.raises(SystemExit):
+        parse_args(["--config", str(config)])
+    settings = parse_args(["--config", str(config), "--topology", "regular"])
+    assert settings["topology"] == "regular"
+
+
+def test_every_setting_has_a_type():
+    assert TYPES.keys() == DEFAULTS.keys()
+
+
+def test_config_file_types_are_checked(tmp_path):
+    config = tmp_path / "run.toml"
+    config.write_text(
+        "peers = 10\nz0 = 0\nz1 = 0.5\ntransaction_mean_gap = 10\n"
+        "print_blockchain = true\nrender = false\nrender-nodes = [0, 2]\n"
+    )
+    settings = parse_args(["--config", str(config)])
+    assert settings["z0"] == 0.0 and isinstance(settings["z0"], float)
+    assert settings["print_blockchain"] == "blockchain.txt"
+    assert settings["render"] is None
+    assert settings["render_nodes"] == [0, 2]
+    config.write_text('peers = "10"\nz0 = 0.5\nz1 = 0.5\ntransaction_mean_gap = 10\n')
+    with pytest.raises(SystemExit) as error:
+        parse_args(["--config", str(config)])
+    assert error.value.code == 2
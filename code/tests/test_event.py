@@ -0,0 +1,69 @@
+import random
+
+import pytest
+
+from event import QUEUE_BACKENDS, CalendarQueue, make_queue
+
+
+def handler():
+    pass
+
+
+def drain(queue):
+    entries = []
+    while not queue.is_empty():
+        entries.append(queue.pop_entry())
+    return entries
+
+
+@pytest.mark.parametrize("backend", sorted(QUEUE_BACKENDS))
+def test_pops_in_time_then_scheduling_order(backend):
+    rng = random.Random(1)
+    queue = make_queue(backend)
+    times = [rng.choice([rng.random() * 1000, float(rng.randrange(10))]) for _ in range(5000)]
+    for time in times:
+        queue.schedule(time, handler)
+    entries = drain(queue)
+    assert [entry[0] for entry in entries] == sorted(times)
+    # Ties are broken by the order the events were scheduled in
+    assert entries == sorted(entries, key=lambda entry: (entry[0], entry[1]))
+
+
+def test_calendar_queue_matches_heap_with_interleaved_operations():
+    rng = random.Random(2)
+    heap, calendar = make_queue("heap"), CalendarQueue()
+    now = 0.0
+    for step in range(20000):
+        # Bursts of scheduling followed by bursts of popping make the
+        # calendar queue grow and shrink several times
+        if rng.random() < (0.7 if (step // 2000) % 2 == 0 else 0.3) or heap.is_empty():
+            # Mostly near-future events, sometimes far ones and exact ties
+            gap = rng.expovariate(1.0) if rng.random() < 0.9 else rng.random() * 1e6
+            time = now + (0.0 if rng.random() < 0.05 else gap)
+            heap.schedule(time, handler)
+            calendar.schedule(time, handler)
+        else:
+            assert calendar.peek_entry()[:2] == heap.peek_entry()[:2]
+            entry = calendar.pop_entry()
+            assert entry[:2] == heap.pop_entry()[:2]
+            now = entry[0]
+        assert len(calendar) == len(heap)
+    assert [entry[:2] for entry in drain(calendar)] == [entry[:2] for entry in drain(heap)]
+
+
+def test_calendar_queue_handles_events_before_the_cursor():
+    queue = CalendarQueue()
+    for time in (100.0, 200.0, 300.0):
+        queue.schedule(time, handler)
+    assert queue.pop_entry()[0] == 100.0
+    queue.schedule(5.0, handler)
+    assert [entry[0] for entry in drain(queue)] == [5.0, 200.0, 300.0]
+
+
+def test_empty_queue():
+    queue = CalendarQueue()
+    assert queue.peek_entry() is None
+    with pytest.raises(IndexError):
+        queue.pop_entry()
+    with pytest.raises(ValueError):
+        make_queue("nope")
@@ -0,0 +1,64 @@
+import math
+
+from parallel import ParallelSimulator, Partition
+from simulator import Simulator
+
+CONFIG = dict(
+    n=60,
+    z0=0.5,
+    z1=0.5,
+    seed=3,
+    max_events=None,
+    min_transactions_per_mining=10,
+    transaction_mean_gap=10,
+)
+UNTIL_TIME = 1200
+
+
+def run_in_process(parts):
+    """Run Partitions in lock-step windows in this process, as ParallelSimulator does across processes."""
+    partitions = [Partition(rank, parts, CONFIG) for rank in range(parts)]
+    lookahead = min(partition.lookahead() for partition in partitions)
+    inboxes = [[] for _ in partitions]
+    while True:
+        pending = [event[1] for inbox in inboxes for message in inbox for event in message[1]]
+        start = min([partition.next_time() for partition in partitions] + pending)
+        if start == math.inf or start > UNTIL_TIME:
+            return partitions
+        bound = min(math.nextafter(start + lookahead, -math.inf), UNTIL_TIME)
+        outgoing = [
+            partition.run(bound, inbox, None)[0]
+            for partition, inbox in zip(partitions, inboxes)
+        ]
+        inboxes = [[] for _ in partitions]
+        for messages in outgoing:
+            for rank, message in messages.items():
+                inboxes[rank].append(message)
+
+
+def serial_heights():
+    simulator = Simulator(**CONFIG)
+    simulator.simulate(until_time=UNTIL_TIME)
+    return [node.blockchain.get_height() for node in simulator.nodes]
+
+
+def test_partitions_link_imported_blocks_to_their_parents():
+    partitions = run_in_process(3)
+    heights = {}
+    for partition in partitions:
+        store = partition.simulator.block_store
+        assert len(store.blocks) > 1
+        # Only the genesis block has no parent
+        assert [serial for serial, parent in enumerate(store.parents) if parent < 0] == [0]
+        for serial in range(1, len(store.blocks)):
+            parent = store.parents[serial]
+            assert store.blocks[parent].block_id == store.blocks[serial].previous_block_id
+            assert store.depths[serial] == store.depths[parent] + 1
+        heights.update(partition.summary()["heights"])
+    assert [heights[i] for i in range(CONFIG["n"])] == serial_heights()
+
+
+def test_parallel_run_matches_serial_heights():
+    options = {key: value for key, value in CONFIG.items() if key != "max_events"}
+    results = ParallelSimulator(workers=2, **options).simulate(until_time=UNTIL_TIME)
+    assert results["heights"] == serial_heights()
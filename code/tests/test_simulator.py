@@ -0,0 +1,115 @@
+from simulator import Simulator
+from tracelog import TraceReader
+
+
+def run_summary(simulator):
+    """Return everything a seed must fix about a finished run."""
+    store = simulator.block_store
+    return (
+        simulator.events_processed,
+        simulator.current_time,
+        [block.block_id for block in store.blocks],
+        [[txn.txn_id for txn in block.transactions] for block in store.blocks],
+        [node.blockchain.get_tip().block_id for node in simulator.nodes],
+    )
+
+
+def test_same_seed_gives_identical_runs_in_one_process():
+    first = Simulator(20, 0.5, 0.5, seed=5, max_events=5000)
+    first.simulate()
+    second = Simulator(20, 0.5, 0.5, seed=5, max_events=5000)
+    second.simulate()
+    assert len(first.block_store.blocks) > 1
+    assert run_summary(first) == run_summary(second)
+
+
+def test_transaction_ids_are_unique_within_a_run():
+    simulator = Simulator(10, 0.5, 0.5, seed=6, max_events=3000)
+    simulator.simulate()
+    ids = list(simulator.transactions)
+    ids += [
+        txn.txn_id
+        for block in simulator.block_store.blocks
+        for txn in block.transactions
+        if txn.sender == -1
+    ]
+    assert len(ids) == len(set(ids))
+
+
+def test_checkpoint_resumes_identically(tmp_path):
+    # A checkpoint taken before any block is mined holds an empty columnar
+    # transaction store, and one taken later holds mined blocks
+    for checkpoint_at in (20, 4000):
+        options = dict(seed=7, max_events=None, columnar_transactions=True)
+        uninterrupted = Simulator(15, 0.5, 0.5, **options)
+        uninterrupted.simulate(max_events=8000)
+
+        simulator = Simulator(15, 0.5, 0.5, **options)
+        simulator.simulate(max_events=checkpoint_at)
+        path = tmp_path / f"run_{checkpoint_at}.ckpt"
+        simulator.save_checkpoint(path)
+        resumed = Simulator.load_checkpoint(path)
+        resumed.simulate(max_events=8000 - checkpoint_at)
+        assert run_summary(resumed) == run_summary(uninterrupted)
+
+
+def test_resumed_trace_continues_from_the_checkpoint(tmp_path):
+    options = dict(seed=9, max_events=None)
+    uninterrupted = Simulator(15, 0.5, 0.5, trace_path=tmp_path / "full.trace", **options)
+    uninterrupted.simulate(max_events=2000)
+    uninterrupted.trace.close()
+    expected = TraceReader(tmp_path / "full.trace").read()
+
+    trace_path = tmp_path / "run.trace"
+    simulator = Simulator(15, 0.5, 0.5, trace_path=trace_path, **options)
+    simulator.simulate(max_events=1000)
+    simulator.save_checkpoint(tmp_path / "run.ckpt")
+    # Events recorded after the checkpoint are dropped when resuming
+    simulator.simulate(max_events=1000)
+    simulator.trace.close()
+
+    fork = Simulator.load_checkpoint(tmp_path / "run.ckpt", trace_path=tmp_path / "fork.trace")
+    fork.simulate(max_events=1000)
+    fork.trace.close()
+    assert len(TraceReader(trace_path)) == 2000
+    assert len(TraceReader(tmp_path / "fork.trace")) == 1000
+
+    resumed = Simulator.load_checkpoint(tmp_path / "run.ckpt")
+    resumed.simulate(max_events=1000)
+    resumed.trace.close()
+    records = TraceReader(trace_path).read()
+    assert len(records) == 2000
+    assert (records == expected).all()
+    assert (records["time"][1:] >= records["time"][:-1]).all()
+
+
+def test_only_the_latest_mining_race_mines():
+    simulator = Simulator(5, 0.5, 0.5, seed=8, max_events=None)
+    node = simulator.nodes[0]
+    node.avg_time = 50
+    mined = []
+    node.mine_block = mined.append
+    node.schedule_mining(0)
+    node.schedule_mining(1)
+    races = []
+    queue = simulator.priority_queue
+    while not queue.is_empty():
+        time, _, handler, args = queue.pop_entry()
+        if getattr(handler, "__self__", None) is node:
+            races.append(args)
+            handler(*args)
+    assert len(races) == 2
+    assert mined == [time for time, generation in races if generation == 2]
+
+    # A block the node mines itself also abandons the race
+    node = simulator.nodes[1]
+    node.schedule_mining(0)
+    # The pool threshold mines a block before the race finishes
+    node.mine_block(0)
+    blocks = len(simulator.block_store.blocks)
+    queue = simulator.priority_queue
+    while not queue.is_empty():
+        _, _, handler, args = queue.pop_entry()
+        if handler == node.finish_mining:
+            handler(*args)
+    assert len(simulator.block_store.blocks) == blocks
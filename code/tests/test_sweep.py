@@ -0,0 +1,32 @@
+from sweep import KEY_FIELDS, run, run_seed
+
+
+def test_every_run_has_its_own_seed():
+    combinations = [(10, 0.3, 0.5, 10.0), (10, 0.5, 0.5, 10.0), (50, 0.3, 0.5, 10.0)]
+    seeds = [
+        run_seed(0, combination, replicate)
+        for combination in combinations
+        for replicate in range(3)
+    ]
+    assert len(set(seeds)) == len(seeds)
+    assert run_seed(0, combinations[1], 2) == seeds[5]
+    assert run_seed(1, combinations[1], 2) != seeds[5]
+
+
+def test_zero_max_events_is_no_limit():
+    run_config = {
+        "peers": 5,
+        "z0": 0.5,
+        "z1": 0.5,
+        "transaction_mean_gap": 10.0,
+        "replicate": 0,
+        "seed": 1,
+        "min_transactions_per_mining": 10,
+        "max_events": 0,
+        "until_time": 200.0,
+        "queue_backend": "heap",
+    }
+    assert set(run_config) == set(KEY_FIELDS)
+    row = run(run_config)
+    assert row["events"] > 0
+    assert row["max_events"] == 0
@@ -0,0 +1,23 @@
+import pickle
+
+from transaction import Transaction, TransactionStore
+
+
+def test_store_round_trips_rows_and_grows_after_pickling():
+    for size in (0, 3, 1500):
+        store = TransactionStore()
+        rows = [Transaction(i, i + 1, i % 50, i / 2, txn_id=i) for i in range(size)]
+        store.extend(rows)
+        restored = pickle.loads(pickle.dumps(store))
+        assert restored.get(0, size) == tuple(rows)
+        more = [Transaction(1, 2, 3, 4.0, txn_id=size + i) for i in range(5)]
+        assert restored.extend(more) == (size, size + 5)
+        restored_rows = restored.get(size, size + 5)
+        assert [txn.timestamp for txn in restored_rows] == [4.0] * 5
+        assert restored_rows == tuple(more)
+
+
+def test_empty_store_can_grow():
+    store = TransactionStore(capacity=0)
+    assert store.extend([Transaction(1, 2, 3, txn_id=7)]) == (0, 1)
+    assert store.get(0, 1)[0].txn_id == 7
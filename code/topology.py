@@ -0,0 +1,299 @@
+import numpy as np
+
+
+class Topology:
+    def __init__(self, n, adjacency):
+        """
+        Initialize an undirected graph stored in CSR form.
+
+        The neighbours of node i are indices[indptr[i]:indptr[i + 1]], sorted
+        in increasing order, so every undirected edge appears twice.
+
+        Parameters:
+        - n: Number of nodes.
+        - adjacency: List of n sets of neighbour IDs.
+        """
+        self.n = n
+        degrees = np.fromiter((len(neighbours) for neighbours in adjacency), np.intp, n)
+        self.indptr = np.zeros(n + 1, dtype=np.intp)
+        np.cumsum(degrees, out=self.indptr[1:])
+        self.indices = np.fromiter(
+            (j for neighbours in adjacency for j in sorted(neighbours)),
+            np.intp,
+            int(self.indptr[-1]),
+        )
+
+    def neighbors(self, i):
+        """Return the sorted array of neighbours of node i."""
+        return self.indices[self.indptr[i] : self.indptr[i + 1]]
+
+    def degree(self, i):
+        """Return the number of neighbours of node i."""
+        return int(self.indptr[i + 1] - self.indptr[i])
+
+    def degrees(self):
+        """Return the array of the degrees of all nodes."""
+        return np.diff(self.indptr)
+
+    def num_edges(self):
+        """Return the number of undirected edges."""
+        return len(self.indices) // 2
+
+    def edge_index(self, i, j):
+        """Return the position of the edge i -> j in `indices`, or None if there is none."""
+        start, end = self.indptr[i], self.indptr[i + 1]
+        position = start + int(np.searchsorted(self.indices[start:end], j))
+        if position < end and self.indices[position] == j:
+            return position
+        return None
+
+    def edge_sources(self):
+        """Return the source node of every entry of `indices`."""
+        return np.repeat(np.arange(self.n), self.degrees())
+
+    def is_connected(self):
+        """Check if the graph is connected using an iterative breadth-first search."""
+        if self.n == 0:
+            return True
+        visited = np.zeros(self.n, dtype=bool)
+        visited[0] = True
+        frontier = np.array([0])
+        while len(frontier):
+            neighbours = np.concatenate(
+                [self.indices[self.indptr[i] : self.indptr[i + 1]] for i in frontier]
+            )
+            frontier = np.unique(neighbours[~visited[neighbours]])
+            visited[frontier] = True
+        return bool(visited.all())
+
+    def to_matrix(self):
+        """Return the graph as a boolean adjacency matrix, as built by graph.py."""
+        matrix = [[False] * self.n for _ in range(self.n)]
+        for i in range(self.n):
+            for j in self.neighbors(i).tolist():
+                matrix[i][j] = True
+        return matrix
+
+
+def partition(topology, parts):
+    """
+    Split the nodes of a topology into `parts` groups of nearly equal size.
+
+    Nodes are ordered breadth-first and the order is cut into contiguous
+    ranges, so neighbours tend to share a group and few edges cross groups.
+    Returns the array of the group of every node.
+    """
+    n = topology.n
+    order = []
+    visited = np.zeros(n, dtype=bool)
+    for start in range(n):
+        if visited[start]:
+            continue
+        visited[start] = True
+        queue = [start]
+        for i in queue:  # The list grows while it is walked
+            for j in topology.neighbors(i).tolist():
+                if not visited[j]:
+                    visited[j] = True
+                    queue.append(j)
+        order += queue
+    owner = np.empty(n, dtype=np.intp)
+    owner[order] = np.arange(n) * parts // max(n, 1)
+    return owner
+
+
+class UnionFind:
+    def __init__(self, n):
+        """Initialize n singleton sets."""
+        self.parent = list(range(n))
+
+    def find(self, i):
+        """Return the representative of the set containing i."""
+        parent = self.parent
+        root = i
+        while parent[root] != root:
+            root = parent[root]
+        while parent[i] != root:  # Path compression
+            parent[i], i = root, parent[i]
+        return root
+
+    def union(self, i, j):
+        """Merge the sets containing i and j, returning False if they were already merged."""
+        root_i, root_j = self.find(i), self.find(j)
+        if root_i == root_j:
+            return False
+        self.parent[root_j] = root_i
+        return True
+
+
+def connect_components(adjacency, rng):
+    """
+    Link the connected components of a graph into one.
+
+    Each component after the first gets one edge to a random node of the
+    components already linked, so at most one edge is added per component.
+    """
+    n = len(adjacency)
+    components = UnionFind(n)
+    for i, neighbours in enumerate(adjacency):
+        for j in neighbours:
+            components.union(i, j)
+    roots = {}
+    for i in rng.permutation(n).tolist():
+        roots.setdefault(components.find(i), i)
+    linked = []
+    for i in roots.values():
+        if linked:
+            j = linked[int(rng.integers(len(linked)))]
+            adjacency[i].add(j)
+            adjacency[j].add(i)
+        linked.append(i)
+    return adjacency
+
+
+def random_graph(n, rng, min_degree=3, max_degree=6):
+    """
+    Generate a connected random graph where node degrees are between min_degree and max_degree.
+
+    A random spanning tree makes the graph connected, then every node gets a
+    target degree drawn from [min_degree, max_degree] and remaining edge
+    stubs are paired at random. Runs in O(n * max_degree) expected time.
+    """
+    max_degree = min(max_degree, n - 1)
+    min_degree = min(min_degree, max_degree)
+    adjacency = [set() for _ in range(n)]
+
+    def can_link(i, j):
+        return (
+            i != j
+            and j not in adjacency[i]
+            and len(adjacency[i]) < max_degree
+            and len(adjacency[j]) < max_degree
+        )
+
+    def link(i, j):
+        adjacency[i].add(j)
+        adjacency[j].add(i)
+
+    # Random spanning tree: attach each node to an earlier one with room left
+    order = rng.permutation(n).tolist()
+    open_nodes = order[:1]
+    for i in order[1:]:
+        slot = int(rng.integers(len(open_nodes)))
+        j = open_nodes[slot]
+        link(i, j)
+        if len(adjacency[j]) >= max_degree:
+            open_nodes[slot] = open_nodes[-1]
+            open_nodes.pop()
+        open_nodes.append(i)
+
+    # Pair the stubs of nodes still below their target degree
+    targets = rng.integers(min_degree, max_degree + 1, n).tolist()
+    stubs = [i for i in range(n) for _ in range(targets[i] - len(adjacency[i]))]
+    rng.shuffle(stubs)
+    for i, j in zip(stubs[::2], stubs[1::2]):
+        if can_link(i, j):
+            link(i, j)
+
+    # Top up nodes left below min_degree by pairing collisions
+    for i in range(n):
+        attempts = 0
+        while len(adjacency[i]) < min_degree and attempts < 10 * max_degree:
+            j = int(rng.integers(n))
+            if can_link(i, j):
+                link(i, j)
+            attempts += 1
+    return Topology(n, adjacency)
+
+
+def random_regular_graph(n, rng, degree=4):
+    """
+    Generate a connected random graph where every node has the given degree.
+
+    Uses the configuration model: edge stubs are shuffled and paired, and
+    self-loops and repeated edges are dropped. Components left over are then
+    linked, so a few nodes may end up one edge off the degree.
+    """
+    degree = min(degree, n - 1)
+    adjacency = [set() for _ in range(n)]
+    stubs = np.repeat(np.arange(n), degree)
+    rng.shuffle(stubs)
+    for i, j in zip(stubs[::2].tolist(), stubs[1::2].tolist()):
+        if i != j:
+            adjacency[i].add(j)
+            adjacency[j].add(i)
+    return Topology(n, connect_components(adjacency, rng))
+
+
+def barabasi_albert_graph(n, rng, edges_per_node=3):
+    """
+    Generate a Barabasi-Albert preferential attachment graph.
+
+    Each new node links to edges_per_node existing nodes chosen with
+    probability proportional to their degree. The graph is connected.
+    """
+    m = min(edges_per_node, n - 1)
+    adjacency = [set() for _ in range(n)]
+    # Nodes repeated once per edge end, for sampling proportional to degree
+    ends = []
+    for i in range(1, m + 1):
+        adjacency[0].add(i)
+        adjacency[i].add(0)
+        ends += [0, i]
+    for i in range(m + 1, n):
+        targets = set()
+        while len(targets) < m:
+            targets.add(ends[int(rng.integers(len(ends)))])
+        for j in targets:
+            adjacency[i].add(j)
+            adjacency[j].add(i)
+            ends += [i, j]
+    return Topology(n, adjacency)
+
+
+def small_world_graph(n, rng, neighbours=4, rewire_probability=0.1):
+    """
+    Generate a connected Watts-Strogatz small-world graph.
+
+    Nodes start on a ring, each linked to its `neighbours` nearest nodes, and
+    every edge is rewired to a random node with the given probability.
+    """
+    k = max(2, min(neighbours, n - 1)) // 2
+    adjacency = [set() for _ in range(n)]
+    for i in range(n):
+        for offset in range(1, k + 1):
+            j = (i + offset) % n
+            if i != j:
+                adjacency[i].add(j)
+                adjacency[j].add(i)
+    for i in range(n):
+        for offset in range(1, k + 1):
+            j = (i + offset) % n
+            if j not in adjacency[i] or rng.random() >= rewire_probability:
+                continue
+            new = int(rng.integers(n))
+            if new == i or new in adjacency[i]:
+                continue
+            adjacency[i].discard(j)
+            adjacency[j].discard(i)
+            adjacency[i].add(new)
+            adjacency[new].add(i)
+    return Topology(n, connect_components(adjacency, rng))
+
+
+# Generators selectable through Simulator(topology=...)
+TOPOLOGIES = {
+    "random": random_graph,
+    "regular": random_regular_graph,
+    "barabasi-albert": barabasi_albert_graph,
+    "small-world": small_world_graph,
+}
+
+
+def generate_topology(name, n, rng):
+    """Generate a connected topology with n nodes using the named generator."""
+    if name not in TOPOLOGIES:
+        raise ValueError(
+            f"Unknown topology {name!r}, expected one of {sorted(TOPOLOGIES)}"
+        )
+    return TOPOLOGIES[name](n, rng)
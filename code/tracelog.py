@@ -0,0 +1,221 @@
+import json
+import os
+
+import numpy as np
+
+MAGIC = b"BCTRACE1"
+
+# One record per processed event
+TRACE_DTYPE = np.dtype(
+    [
+        ("time", "<f8"),
+        ("kind", "u1"),
+        ("source", "<i4"),  # Node that sent or scheduled the event, -1 if none
+        ("target", "<i4"),  # Node that handles the event, -1 if none
+        ("ref", "<i8"),  # Block serial or first transaction ID, -1 if none
+    ]
+)
+
+# Event kinds, named after the handlers of the events. Kinds are only
+# appended, so the codes of older traces stay the same
+KINDS = [
+    "other",
+    "generate_transactions",
+    "broadcast_transaction",
+    "receive_transaction",
+    "deliver_block",
+    "propagate_block",
+    "conditional_mine_block",
+    "send_inventory",
+    "receive_inventory",
+    "receive_getdata",
+    "receive_transactions",
+    "finish_mining",
+]
+KIND_CODES = {name: code for code, name in enumerate(KINDS)}
+
+
+def node_of(owner):
+    """Return the ID of the node behind a Peer or Node, or -1."""
+    node = getattr(owner, "node", owner)
+    return getattr(node, "id", -1)
+
+
+def describe(entry, block_store):
+    """
+    Describe a processed queue entry as a trace record.
+
+    Parameters:
+    - entry: (time, seq, handler, args) tuple popped from the event queue.
+    - block_store: BlockStore used to turn blocks into serials.
+
+    Returns a (time, kind, source, target, ref) tuple.
+    """
+    time, _, handler, args = entry
+    name = getattr(handler, "__name__", "other")
+    kind = KIND_CODES.get(name, 0)
+    node = node_of(getattr(handler, "__self__", None))
+    if name == "deliver_block":
+        peer, block, _, sender = args
+        return time, kind, sender, node_of(peer), block_store.serial(block)
+    if name == "receive_transaction":
+        transaction, _, sender = args
+        return time, kind, -1 if sender is None else sender, node, transaction.txn_id
+    if name in ("receive_inventory", "receive_getdata"):
+        txn_ids, _, sender = args
+        return time, kind, sender, node, txn_ids[0]
+    if name == "receive_transactions":
+        transactions, _, sender = args
+        return time, kind, sender, node, transactions[0].txn_id
+    if name == "broadcast_transaction":
+        return time, kind, node, -1, args[0].txn_id
+    if name == "propagate_block":
+        return time, kind, node, -1, block_store.serial(args[0])
+    return time, kind, node, node, -1
+
+
+class TraceRecorder:
+    def __init__(self, path, chunk_size=65536):
+        """
+        Initialize a recorder appending event records to a binary trace file.
+
+        The file starts with MAGIC, a little-endian uint32 header length and
+        a JSON header naming the record fields and event kinds, followed by
+        packed TRACE_DTYPE records. Records are buffered and written in
+        chunks of `chunk_size`.
+
+        Parameters:
+        - path: Path of the trace file, overwritten if it exists.
+        - chunk_size: Number of records buffered before each write.
+        """
+        self.path = path
+        self.chunk_size = chunk_size
+        self._records = []
+        self.recorded = 0
+        header = json.dumps(
+            {"dtype": TRACE_DTYPE.descr, "kinds": KINDS}
+        ).encode()
+        self._file = open(path, "wb")
+        self._file.write(MAGIC)
+        self._file.write(len(header).to_bytes(4, "little"))
+        self._file.write(header)
+
+    def record(self, time, kind, source, target, ref):
+        """Buffer one record, flushing the buffer when a chunk is full."""
+        self._records.append((time, kind, source, target, ref))
+        if len(self._records) >= self.chunk_size:
+            self.flush()
+
+    def record_entry(self, entry, block_store):
+        """Buffer the record of a processed queue entry."""
+        self._records.append(describe(entry, block_store))
+        if len(self._records) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered records to the file."""
+        if self._records:
+            self._file.write(np.array(self._records, dtype=TRACE_DTYPE).tobytes())
+            self.recorded += len(self._records)
+            self._records = []
+        self._file.flush()
+
+    def close(self):
+        """Flush the buffered records and close the file."""
+        if self._file is not None and not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    def reopen(self):
+        """
+        Reopen the file of a restored recorder to continue recording.
+
+        The file usually holds records written after the recorder was saved,
+        so it is truncated back to the `recorded` records the recorder knows
+        of before new records are appended.
+        """
+        file = open(self.path, "r+b")
+        if file.read(len(MAGIC)) != MAGIC:
+            file.close()
+            raise ValueError(f"{self.path} is not a simulator trace")
+        length = int.from_bytes(file.read(4), "little")
+        size = len(MAGIC) + 4 + length + self.recorded * TRACE_DTYPE.itemsize
+        if os.path.getsize(self.path) < size:
+            file.close()
+            raise ValueError(
+                f"{self.path} holds fewer than the {self.recorded} records of the checkpoint"
+            )
+        file.truncate(size)
+        file.seek(size)
+        self._file = file
+
+    def __getstate__(self):
+        # Open files cannot be pickled; reopen() continues a restored recorder
+        self.flush()
+        state = self.__dict__.copy()
+        del state["_file"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._file = None
+
+
+class TraceReader:
+    def __init__(self, path):
+        """
+        Initialize a reader for a trace written by TraceRecorder.
+
+        Parameters:
+        - path: Path of the trace file.
+        """
+        self.path = path
+        with open(path, "rb") as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a simulator trace")
+            length = int.from_bytes(file.read(4), "little")
+            header = json.loads(file.read(length))
+        self.dtype = np.dtype([tuple(field) for field in header["dtype"]])
+        self.kinds = header["kinds"]
+        self.offset = len(MAGIC) + 4 + length
+
+    def __len__(self):
+        return (os.path.getsize(self.path) - self.offset) // self.dtype.itemsize
+
+    def kind_code(self, name):
+        """Return the code stored in the kind field for an event kind."""
+        return self.kinds.index(name)
+
+    def read(self, kind=None):
+        """Return all records, or only those of one event kind, as a structured array."""
+        records = np.memmap(self.path, dtype=self.dtype, mode="r", offset=self.offset)
+        if kind is not None:
+            return np.asarray(records[records["kind"] == self.kind_code(kind)])
+        return np.asarray(records)
+
+    def iter_chunks(self, chunk_size=65536):
+        """Yield the records in processing order, in arrays of up to chunk_size records."""
+        with open(self.path, "rb") as file:
+            file.seek(self.offset)
+            while True:
+                chunk = np.fromfile(file, dtype=self.dtype, count=chunk_size)
+                if not len(chunk):
+                    return
+                yield chunk
+
+    def replay(self, handlers, chunk_size=65536):
+        """
+        Replay the recorded events in processing order.
+
+        Parameters:
+        - handlers: Dict mapping event kind names to callables, called as
+          handler(time, source, target, ref). Kinds without a handler are
+          skipped.
+        - chunk_size: Number of records read at a time.
+        """
+        by_code = {self.kind_code(name): handler for name, handler in handlers.items()}
+        for chunk in self.iter_chunks(chunk_size):
+            for time, kind, source, target, ref in chunk.tolist():
+                handler = by_code.get(kind)
+                if handler is not None:
+                    handler(time, source, target, ref)
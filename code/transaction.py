@@ -1,5 +1,16 @@
+from itertools import count
+
+import numpy as np
+
+
 class Transaction:
-    def __init__(self, sender, receiver, amount, timestamp=0):
+    __slots__ = ("txn_id", "sender", "receiver", "amount", "timestamp")
+
+    # Source of the IDs of transactions created without one, outside of a
+    # Simulator, which numbers the transactions of its run itself
+    _ids = count()
+
+    def __init__(self, sender, receiver, amount, timestamp=0, txn_id=None):
         """
         Initialize a Transaction object.
 
@@ -8,14 +19,105 @@ class Transaction:
         - receiver: ID of the receiver.
         - amount: Amount of coins being transferred.
         - timestamp: Timestamp of the transaction.
+        - txn_id: Unique ID of the transaction, assigned automatically if None.
         """
+        self.txn_id = next(Transaction._ids) if txn_id is None else txn_id
         self.sender = sender
         self.receiver = receiver
         self.amount = amount
         self.timestamp = timestamp
 
+    def __eq__(self, other):
+        """Check equality between transactions based on their IDs."""
+        return isinstance(other, Transaction) and self.txn_id == other.txn_id
+
+    def __hash__(self):
+        return hash(self.txn_id)
+
+    def __reduce__(self):
+        # Pickle as constructor arguments, much smaller than the slot dict
+        return (
+            Transaction,
+            (self.sender, self.receiver, self.amount, self.timestamp, self.txn_id),
+        )
+
     def __str__(self) -> str:
         """
         Return a string representation of the transaction.
         """
         return f"TxnID: ID{self.sender} pays ID{self.receiver} {self.amount} coins"
+
+
+class TransactionStore:
+    # Columns of the store and their dtypes
+    COLUMNS = {
+        "txn_id": np.int64,
+        "sender": np.int64,
+        "receiver": np.int64,
+        "amount": np.int64,
+        "timestamp": np.float64,
+    }
+
+    def __init__(self, capacity=1024):
+        """
+        Initialize an append-only columnar store of transactions.
+
+        Each field is kept in its own NumPy array, so a transaction costs
+        40 bytes instead of a Python object. Blocks reference the range of
+        rows holding their transactions.
+
+        Parameters:
+        - capacity: Initial number of rows, doubled whenever the store is full.
+        """
+        self.size = 0
+        self.columns = {
+            name: np.empty(capacity, dtype=dtype) for name, dtype in self.COLUMNS.items()
+        }
+
+    def __getstate__(self):
+        # Only the used rows are saved
+        return {
+            "size": self.size,
+            "columns": {
+                name: column[: self.size].copy() for name, column in self.columns.items()
+            },
+        }
+
+    def extend(self, transactions):
+        """Append transactions and return the (start, stop) range of their rows."""
+        transactions = list(transactions)
+        start, stop = self.size, self.size + len(transactions)
+        capacity = len(self.columns["txn_id"])
+        if stop > capacity:
+            # A store restored from a checkpoint may have no rows at all
+            capacity = max(capacity, 1)
+            while stop > capacity:
+                capacity *= 2
+            for name, column in self.columns.items():
+                grown = np.empty(capacity, dtype=column.dtype)
+                grown[: self.size] = column[: self.size]
+                self.columns[name] = grown
+        for name in self.COLUMNS:
+            self.columns[name][start:stop] = [
+                getattr(txn, name) for txn in transactions
+            ]
+        self.size = stop
+        return start, stop
+
+    def get(self, start, stop):
+        """Return the transactions in rows [start, stop) as a tuple of Transaction objects."""
+        rows = zip(
+            *(self.columns[name][start:stop].tolist() for name in self.COLUMNS)
+        )
+        return tuple(
+            Transaction(sender, receiver, amount, timestamp, txn_id)
+            for txn_id, sender, receiver, amount, timestamp in rows
+        )
+
+    def view(self, start, stop):
+        """Return read-only views of the columns for rows [start, stop)."""
+        views = {}
+        for name, column in self.columns.items():
+            views[name] = column[start:stop]
+            views[name].flags.writeable = False
+        return views